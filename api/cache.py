@@ -0,0 +1,48 @@
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+
+from core.cache import CachedResponse, get_response_cache
+
+
+class CachedListMixin:
+    """
+    Serves GET responses of a view from the response cache, keyed by the version tokens of
+    `cache_models`, and answers If-None-Match with 304 while those models are unchanged.
+    """
+    cache_models = ()
+    cache_media_types = ("application/json",)
+
+    def cached(self, handler, request, *args, **kwargs):
+        cache = get_response_cache()
+        # responses built inside a transaction may hold rows that are never committed
+        if (cache is None or request.method != "GET" or request.accepted_media_type not in self.cache_media_types
+                or transaction.get_connection().in_atomic_block):
+            return handler(request, *args, **kwargs)
+        key, etag = cache.key(request, request.accepted_media_type, self.cache_models)
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+        if etag in if_none_match or "*" in if_none_match:
+            cache.count("not_modified")
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            return response
+        entry = cache.get(key)
+        if entry is not None:
+            response = HttpResponse(entry.content, content_type=entry.content_type)
+            response["ETag"] = etag
+            response["X-Cache"] = "HIT"
+            return response
+        self.cache_entry = key, etag
+        return handler(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        cache_entry = getattr(self, "cache_entry", None)
+        if cache_entry is not None and isinstance(response, Response) and response.status_code == 200:
+            key, etag = cache_entry
+            response.render()
+            get_response_cache().set(key, CachedResponse(response.content, response["Content-Type"]))
+            response["ETag"] = etag
+            response["X-Cache"] = "MISS"
+        return response
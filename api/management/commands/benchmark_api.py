@@ -0,0 +1,262 @@
+import json
+import math
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+from rest_framework.settings import api_settings
+
+from app.ledger import record_movements, receipts
+from app.models import Unit, Category, Product, ProductUnit, ProductBatch, ProductSale, SaleTransaction
+from app.rollups import rebuild_day
+from app.search import index_products
+from app.stock import refresh_stock
+from core.metrics import RequestMetrics
+
+CHUNK_SIZE = 10000
+LINES_PER_SALE = 3
+WORDS = ("rice", "beans", "garri", "yam", "oil", "salt", "sugar", "milk", "flour", "pepper", "tomato", "onion",
+         "noodles", "pasta", "tea", "cocoa", "soap", "corn", "millet", "honey")
+# p50 and p99 may grow, and throughput drop, by this fraction of the baseline before it is a regression
+TOLERANCE = 0.25
+
+
+def chunks(total, size=CHUNK_SIZE):
+    for start in range(0, total, size):
+        yield start, min(start + size, total)
+
+
+def money(value):
+    return Decimal(value).quantize(Decimal("0.01"))
+
+
+def seed(products, batches, sale_lines, rng, log):
+    """
+    Bulk insert `products` products with one product unit each, `batches` batches spread over
+    them with their receipts in the stock ledger and `sale_lines` sale lines of LINES_PER_SALE
+    lines per sale, then build the stock snapshots, sales rollups and search entries that signals
+    and checkout would have kept up to date.
+    """
+    first_day = timezone.localdate()
+    units = Unit.objects.bulk_create(Unit(name=f"benchmark {word}") for word in ("bag", "tin", "carton", "crate"))
+    categories = Category.objects.bulk_create(Category(name=f"benchmark {word}") for word in WORDS)
+    product_unit_ids = []
+    for start, end in chunks(products):
+        with transaction.atomic():
+            created = Product.objects.bulk_create(
+                Product(name=f"{WORDS[i % len(WORDS)]} {WORDS[i // len(WORDS) % len(WORDS)]} {i}",
+                        category=categories[i % len(categories)])
+                for i in range(start, end))
+            product_unit_ids += [product_unit.pk for product_unit in ProductUnit.objects.bulk_create(
+                ProductUnit(product=product, unit=units[product.pk % len(units)]) for product in created)]
+        log(f"products {end}/{products}")
+
+    batch_rows = []
+    for start, end in chunks(batches):
+        with transaction.atomic():
+            rows = []
+            for i in range(start, end):
+                cost_price = money(rng.uniform(1, 500))
+                rows.append(ProductBatch(product_unit_id=product_unit_ids[i % products],
+                                         # about half of the older batches are sold out
+                                         quantity=rng.choice((0, rng.randint(1, 500))), cost_price=cost_price,
+                                         selling_price=money(cost_price * Decimal("1.2"))))
+            created = ProductBatch.objects.bulk_create(rows)
+            record_movements(receipts(created))
+            batch_rows += [(batch.pk, batch.product_unit_id, batch.cost_price, batch.selling_price)
+                           for batch in created[::max(1, batches // 100000)]]
+        log(f"batches {end}/{batches}")
+
+    for start, end in chunks(sale_lines, CHUNK_SIZE // LINES_PER_SALE * LINES_PER_SALE):
+        with transaction.atomic():
+            sales = SaleTransaction.objects.bulk_create(
+                SaleTransaction(percentage_discount=rng.choice((0, 0, 5, 10)))
+                for _ in range(0, end - start, LINES_PER_SALE))
+            lines = []
+            for i in range(end - start):
+                batch_id, product_unit_id, cost_price, selling_price = rng.choice(batch_rows)
+                lines.append(ProductSale(sale_id=sales[i // LINES_PER_SALE].pk, batch_id=batch_id,
+                                         product_unit_id=product_unit_id, cost_price=cost_price,
+                                         selling_price=selling_price, quantity=rng.randint(1, 5)))
+            ProductSale.objects.bulk_create(lines)
+        log(f"sale lines {end}/{sale_lines}")
+
+    for start, end in chunks(products):
+        with transaction.atomic():
+            refresh_stock(product_unit_ids[start:end])
+    day = first_day
+    while day <= timezone.localdate():
+        rebuild_day(day)
+        day += timedelta(days=1)
+    index_products(Product.objects.values_list("id", flat=True))
+    log("stock snapshots, sales rollups and search entries built")
+
+
+class Scenarios:
+    """The requests to time, each a function returning (method, path, data) for the next call."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.product_unit_ids = list(ProductUnit.objects.filter(stock__total_quantity__gt=0)
+                                     .values_list("id", flat=True)[:10000])
+        self.pages = max(1, math.ceil(Product.objects.count() / api_settings.PAGE_SIZE))
+        if not self.product_unit_ids:
+            raise CommandError("There is no stock to benchmark against, seed the database first")
+
+    def catalog(self):
+        return "get", "/api/v1/products", {"page": self.rng.randint(1, min(self.pages, 1000))}
+
+    def search(self):
+        return "get", "/api/v1/products", {"search": self.rng.choice(WORDS)}
+
+    def batch_intake(self):
+        cost_price = money(self.rng.uniform(1, 500))
+        return "post", "/api/v1/product-batches/", {
+            "product_unit": self.rng.choice(self.product_unit_ids), "quantity": self.rng.randint(1, 10000),
+            "cost_price": str(cost_price), "selling_price": str(money(cost_price * Decimal("1.2"))),
+        }
+
+    def checkout(self):
+        product_unit_ids = self.rng.sample(self.product_unit_ids, min(len(self.product_unit_ids),
+                                                                     self.rng.randint(1, 3)))
+        return "post", "/api/v1/sales/", {"sales": [{"product_unit": pk, "quantity": 1}
+                                                    for pk in product_unit_ids]}
+
+    def sales_history(self):
+        return "get", "/api/v1/sales/", {"page_size": 20}
+
+    names = ("catalog", "search", "batch_intake", "checkout", "sales_history")
+
+
+def percentile(timings, percent):
+    return statistics.quantiles(timings, n=100, method="inclusive")[percent - 1] if len(timings) > 1 else timings[0]
+
+
+class Command(BaseCommand):
+    help = ("Seed a large catalog and sales history with bulk inserts, then time the main v1 endpoints "
+            "through the real URLconf and report p50/p99 latency, throughput and queries per request. "
+            "Runs in a throwaway test database unless --in-place is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100000)
+        parser.add_argument("--batches", type=int, default=1000000)
+        parser.add_argument("--sale-lines", type=int, default=5000000)
+        parser.add_argument("--no-seed", action="store_true", help="reuse the data of an earlier run")
+        parser.add_argument("--keepdb", action="store_true",
+                            help="keep the test database for a later --no-seed run, it needs a TEST NAME on sqlite")
+        parser.add_argument("--in-place", action="store_true",
+                            help="seed and time the configured databases instead of a test database")
+        parser.add_argument("--yes-i-mean-it", action="store_true",
+                            help="allow --in-place with DEBUG off")
+        parser.add_argument("--requests", type=int, default=200, help="timed requests per scenario")
+        parser.add_argument("--warmup", type=int, default=10, help="untimed requests per scenario")
+        parser.add_argument("--scenario", action="append", choices=Scenarios.names,
+                            help="run only these scenarios, may be repeated")
+        parser.add_argument("--random-seed", type=int, default=0)
+        parser.add_argument("--save-baseline", help="write the results to this JSON file")
+        parser.add_argument("--baseline", help="fail when the results regress against this JSON file")
+        parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+
+    def run(self, client, request):
+        method, path, data = request()
+        metrics = RequestMetrics(keep_sql=False)
+        started = time.perf_counter()
+        with connection.execute_wrapper(metrics):
+            if method == "get":
+                response = client.get(path, data)
+            else:
+                response = client.post(path, data, content_type="application/json")
+        return time.perf_counter() - started, metrics.queries, response.status_code
+
+    def measure(self, client, request, requests, warmup):
+        for _ in range(warmup):
+            self.run(client, request)
+        timings, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            elapsed, count, status = self.run(client, request)
+            timings.append(elapsed * 1000)
+            queries.append(count)
+            errors += status >= 400
+        elapsed = time.perf_counter() - started
+        return {
+            "p50_ms": round(percentile(timings, 50), 3),
+            "p99_ms": round(percentile(timings, 99), 3),
+            "throughput": round(requests / elapsed, 1),
+            "queries": round(statistics.mean(queries), 2),
+            "max_queries": max(queries),
+            "errors": errors,
+        }
+
+    def regressions(self, results, baseline, tolerance):
+        found = []
+        for name, result in results.items():
+            expected = baseline.get(name)
+            if expected is None:
+                continue
+            for key in ("p50_ms", "p99_ms"):
+                if result[key] > expected[key] * (1 + tolerance):
+                    found.append(f"{name} {key} {expected[key]} -> {result[key]}")
+            if result["throughput"] < expected["throughput"] * (1 - tolerance):
+                found.append(f"{name} throughput {expected['throughput']} -> {result['throughput']}")
+            # query counts do not depend on the machine, any increase is a regression
+            if result["max_queries"] > expected["max_queries"]:
+                found.append(f"{name} max_queries {expected['max_queries']} -> {result['max_queries']}")
+            if result["errors"] > expected["errors"]:
+                found.append(f"{name} errors {expected['errors']} -> {result['errors']}")
+        return found
+
+    def handle(self, *args, keepdb, in_place, yes_i_mean_it, **options):
+        if options["requests"] < 1:
+            raise CommandError("--requests must be at least 1")
+        if in_place:
+            # seeding writes millions of rows into whatever DB_NAME points at
+            if not (settings.DEBUG or yes_i_mean_it):
+                raise CommandError("--in-place seeds the configured database, it needs DEBUG on or --yes-i-mean-it")
+            return self.benchmark(**options)
+        # created and destroyed the way the test runner does it
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=keepdb)
+        try:
+            return self.benchmark(**options)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=keepdb)
+
+    def benchmark(self, products, batches, sale_lines, no_seed, requests, warmup, scenario, random_seed,
+                  save_baseline, baseline, tolerance, **options):
+        rng = random.Random(random_seed)
+        if not no_seed:
+            if Unit.global_objects.filter(name="benchmark bag").exists():
+                raise CommandError("The database is already seeded, pass --no-seed to reuse its data")
+            started = time.perf_counter()
+            seed(products, batches, sale_lines, rng, log=lambda message: self.stderr.write(message))
+            self.stdout.write(f"seeded {products} products, {batches} batches and {sale_lines} sale lines "
+                              f"in {time.perf_counter() - started:.1f}s")
+
+        scenarios = Scenarios(rng)
+        client = Client(HTTP_HOST="localhost")
+        results = {}
+        for name in scenario or Scenarios.names:
+            results[name] = result = self.measure(client, getattr(scenarios, name), requests, warmup)
+            self.stdout.write(f"{name:<14} p50 {result['p50_ms']:>8.2f}ms  p99 {result['p99_ms']:>8.2f}ms  "
+                              f"{result['throughput']:>7.1f} req/s  {result['queries']:>5.1f} queries/request  "
+                              f"{result['errors']} errors")
+
+        if save_baseline:
+            with open(save_baseline, "w") as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+            self.stdout.write(f"baseline saved to {save_baseline}")
+        if baseline:
+            with open(baseline) as file:
+                found = self.regressions(results, json.load(file), tolerance)
+            if found:
+                raise CommandError("Regressions against the baseline:\n  " + "\n  ".join(found))
+            self.stdout.write("no regressions against the baseline")
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from importlib.util import find_spec
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+
+from api.management.commands.benchmark_api import percentile, seed
+from app.models import Product
+
+# the same reads, served by the sync DRF views under WSGI and by their async twins under ASGI
+PATHS = {
+    "wsgi": ("/api/v1/products?page={n}", "/api/v1/product-units?page={n}", "/api/v1/sales/?page_size=20"),
+    "asgi": ("/api/v1/async/products?page={n}", "/api/v1/async/product-units?page={n}",
+             "/api/v1/async/sales/?page_size=20"),
+}
+APPLICATIONS = {
+    "wsgi": ("config.wsgi:application", "wsgi"),
+    "asgi": ("config.asgi:application", "asgi3"),
+}
+# run uvicorn with every query delayed by a round trip, as to a database across the network
+SERVER = """
+import sys, time, uvicorn
+from django.db.backends.signals import connection_created
+
+application, interface, port, latency = sys.argv[1], sys.argv[2], int(sys.argv[3]), float(sys.argv[4])
+
+def round_trip(execute, *args):
+    time.sleep(latency)
+    return execute(*args)
+
+def delay_queries(connection, **kwargs):
+    if round_trip not in connection.execute_wrappers:
+        connection.execute_wrappers.append(round_trip)
+
+if latency:
+    connection_created.connect(delay_queries)
+uvicorn.run(application, interface=interface, port=port, log_level="warning", access_log=False, backlog=4096)
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    headers = dict(line.split(b": ", 1) for line in head.split(b"\r\n")[1:] if b": " in line)
+    headers = {name.lower(): value for name, value in headers.items()}
+    if b"content-length" in headers:
+        await reader.readexactly(int(headers[b"content-length"]))
+    else:
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    return status
+
+
+async def client(port, paths, requests, delay, timings, errors):
+    """
+    One keep-alive client that is slow on the wire: it trickles each request out in two writes
+    `delay` seconds apart, as a client on a poor mobile link would.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        for index in range(requests):
+            request = f"GET {paths[index % len(paths)]} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode()
+            started = time.perf_counter()
+            writer.write(request[:len(request) // 2])
+            await writer.drain()
+            await asyncio.sleep(delay)
+            writer.write(request[len(request) // 2:])
+            await writer.drain()
+            status = await read_response(reader)
+            timings.append((time.perf_counter() - started - delay) * 1000)
+            if status >= 400:
+                errors.append(status)
+    except (OSError, asyncio.IncompleteReadError) as e:
+        errors.append(type(e).__name__)
+    finally:
+        writer.close()
+
+
+async def drive(port, paths, clients, requests, delay):
+    timings, errors = [], []
+    started = time.perf_counter()
+    await asyncio.gather(*(client(port, paths, requests, delay, timings, errors) for _ in range(clients)))
+    return timings, errors, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = ("Serve config.wsgi and config.asgi in turn under uvicorn and drive the catalog, product unit "
+            "and sales history reads with many concurrent slow clients, reporting latency and throughput. "
+            "Seeds a small catalog into a throwaway test database unless --in-place is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=200, help="concurrent connections")
+        parser.add_argument("--requests", type=int, default=10, help="requests per connection")
+        parser.add_argument("--delay", type=float, default=0.05,
+                            help="seconds each client takes to send a request")
+        parser.add_argument("--db-latency", type=float, default=2,
+                            help="milliseconds added to every query, 0 for the raw local database")
+        parser.add_argument("--products", type=int, default=5000, help="products to seed the test database with")
+        parser.add_argument("--in-place", action="store_true",
+                            help="serve the configured database as it is instead of seeding a test database")
+
+    def serve(self, interface, port, db_latency):
+        application, protocol = APPLICATIONS[interface]
+        # the async views have no response cache, compare the request paths without it; the server
+        # opens the database this process is using, which is the test database unless --in-place
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": "config.settings", "RESPONSE_CACHE_BACKEND": "",
+               "DB_NAME": str(connection.settings_dict["NAME"])}
+        command = [sys.executable, "-c", SERVER, application, protocol, str(port), str(db_latency / 1000)]
+        server = subprocess.Popen(command, env=env)
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                return server
+            except OSError:
+                time.sleep(0.1)
+        server.terminate()
+        raise CommandError(f"uvicorn did not start serving {application}")
+
+    def handle(self, *args, products, in_place, **options):
+        if find_spec("uvicorn") is None:
+            raise CommandError("uvicorn is not installed")
+        if in_place:
+            if not Product.objects.exists():
+                raise CommandError("The configured database has no products, leave out --in-place to "
+                                   "benchmark a seeded test database")
+            return self.benchmark(**options)
+        test_settings = connection.settings_dict["TEST"]
+        configured_test_name = test_settings["NAME"]
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == "sqlite":
+                # a file the uvicorn processes can open too, rather than the in-memory test database
+                test_settings["NAME"] = os.path.join(directory, "benchmark.sqlite3")
+            # created and destroyed the way the test runner does it
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                seed(products, products * 10, products * 30, random.Random(0), log=lambda message: None)
+                return self.benchmark(**options)
+            finally:
+                teardown_databases(old_config, verbosity=0)
+                test_settings["NAME"] = configured_test_name
+
+    def benchmark(self, clients, requests, delay, db_latency, **options):
+        pages = max(1, min(Product.objects.count() // 20, 50))
+
+        for interface in ("wsgi", "asgi"):
+            paths = [path.format(n=n % pages + 1) for n in range(pages) for path in PATHS[interface]]
+            port = free_port()
+            server = self.serve(interface, port, db_latency)
+            try:
+                asyncio.run(drive(port, paths, 5, 2, 0))
+                timings, errors, elapsed = asyncio.run(drive(port, paths, clients, requests, delay))
+            finally:
+                server.terminate()
+                server.wait()
+            if not timings:
+                self.stdout.write(f"{interface}: no request completed, errors: {errors[:5]}")
+                continue
+            self.stdout.write(f"{interface}: {clients} clients x {requests} requests in {elapsed:.2f}s, "
+                              f"{len(timings) / elapsed:.0f} req/s, p50 {percentile(timings, 50):.1f}ms, "
+                              f"p99 {percentile(timings, 99):.1f}ms, mean {statistics.mean(timings):.1f}ms, "
+                              f"{len(errors)} errors")
@@ -0,0 +1,77 @@
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.response import Response
+
+from api.renderers import CustomJSONRenderer, orjson
+
+
+def sale_rows(count, raw):
+    """
+    Build `count` sales shaped like SaleTransactionSerializer output, three lines each.
+
+    Raw rows hold Decimal and datetime values, as read straight off the database, instead of
+    the strings serializer fields produce.
+    """
+    now = timezone.now()
+
+    def money(value):
+        value = Decimal(value).quantize(Decimal("0.01"))
+        return value if raw else str(value)
+
+    def moment(value):
+        return value if raw else value.isoformat().replace("+00:00", "Z")
+
+    rows = []
+    for pk in range(1, count + 1):
+        created_at = moment(now - timedelta(minutes=pk))
+        lines = [{
+            "id": pk * 3 + line, "product_unit": f"bag(s) of product {line}", "profit": money(line + 1),
+            "total_selling_price": money(line * 2 + 2), "total_cost_price": money(line + 1),
+            "cost_price": money(line + 1), "selling_price": money(line * 2 + 2), "quantity": 1,
+            "created_at": created_at, "updated_at": created_at, "transaction_id": None,
+            "sale": pk, "batch": pk,
+        } for line in range(3)]
+        rows.append({
+            "id": pk, "sales": lines, "actual_selling_price": money(12), "actual_profit": money(6),
+            "total_cost_price": money(6), "final_profit": money(6), "final_selling_price": money(12),
+            "created_at": created_at, "updated_at": created_at, "transaction_id": None,
+            "percentage_discount": money(0),
+        })
+    return {"count": count, "next": None, "previous": None, "results": rows}
+
+
+class Command(BaseCommand):
+    help = "Compare rendering sale list payloads with orjson against DRF's stdlib json encoder"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def time_render(self, renderer, payload, repeat):
+        context = {"response": Response(status=200)}
+        content = renderer.render(payload, "application/json", context)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            renderer.render(payload, "application/json", context)
+        return content, (time.perf_counter() - started) / repeat * 1000
+
+    def handle(self, *args, rows, repeat, **options):
+        if orjson is None:
+            self.stderr.write("orjson is not installed, only the stdlib encoder is available")
+            return
+        stdlib, fast = CustomJSONRenderer(), CustomJSONRenderer()
+        stdlib.fast = False
+        for raw in (False, True):
+            payload = sale_rows(rows, raw)
+            expected, stdlib_ms = self.time_render(stdlib, payload, repeat)
+            content, fast_ms = self.time_render(fast, payload, repeat)
+            if json.loads(content) != json.loads(expected):
+                self.stderr.write("orjson output differs from the stdlib encoder")
+            self.stdout.write(f"{rows} {'raw' if raw else 'serialized'} sales, {len(content)} bytes: "
+                              f"stdlib {stdlib_ms:.2f}ms, orjson {fast_ms:.2f}ms, "
+                              f"{stdlib_ms / fast_ms:.1f}x faster")
@@ -0,0 +1,69 @@
+from django.core.paginator import InvalidPage
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+async def render_rows(reader, rows):
+    # readers that read more than the page itself, like the sale reader, do it with the async ORM
+    arender_rows = getattr(reader, "arender_rows", None)
+    return await arender_rows(rows) if arender_rows else reader.render_rows(rows)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over the primary key, newest first.
+
+    Pages are fetched with `WHERE id < cursor LIMIT n`, so there is no COUNT(*) or OFFSET and
+    every page costs the same however deep into the history it is. Ids grow with created_at,
+    so this is also creation order.
+    """
+    ordering = "-id"
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+    async def apaginate(self, request, queryset, reader):
+        """
+        Read one page of `queryset` with the async ORM and render it through `reader`.
+
+        Follows CursorPagination.paginate_queryset up to its one query, then leaves the links
+        and cursors to DRF.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, None)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, position = self.cursor or (0, False, None)
+        queryset = reader.values(queryset).order_by("id" if reverse else "-id")
+        if position is not None:
+            queryset = queryset.filter(**{"id__gt" if reverse else "id__lt": position})
+        # one row past the page tells whether there is a page after it
+        results = [row async for row in queryset[offset:offset + self.page_size + 1]]
+        self.page = results[:self.page_size]
+        following = results[-1]["id"] if len(results) > self.page_size else None
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None or offset > 0, position
+            self.has_previous, self.previous_position = following is not None, following
+        else:
+            self.has_next, self.next_position = following is not None, following
+            self.has_previous, self.previous_position = position is not None or offset > 0, position
+        return self.get_paginated_response(await render_rows(reader, self.page)).data
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    """The default page number pagination, counted and read with the async ORM."""
+
+    async def apaginate(self, request, queryset, reader):
+        """Count and read one page of `queryset` and render it through `reader`, with DRF's links."""
+        self.request = request
+        paginator = self.django_paginator_class(reader.values(queryset), self.get_page_size(request))
+        # counted up front, so the paginator never counts in sync code
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        rows = [row async for row in self.page.object_list]
+        return self.get_paginated_response(await render_rows(reader, rows)).data
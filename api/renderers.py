@@ -1,7 +1,31 @@
 from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.metrics import timing_render
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# UTC datetimes end in Z and dict keys may be ints, as with DRF's encoder
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS if orjson else 0
+# escaped to keep the output a strict javascript subset, as DRF does
+LINE_SEPARATORS = (("\u2028".encode(), b"\\u2028"), ("\u2029".encode(), b"\\u2029"))
+
+
+drf_encoder = JSONEncoder()
+
+
+def encode_default(obj):
+    """Encode what orjson has no native support for (Decimal, lazy strings, ...) the way DRF does."""
+    return drf_encoder.default(obj)
 
 
 class CustomJSONRenderer(JSONRenderer):
+    # encode with orjson when it is installed, and with DRF's stdlib json encoder otherwise
+    fast = orjson is not None
+
     def render(self, data, accepted_media_type=None, renderer_context=None):
         # Default response structure
         response = {
@@ -32,7 +56,23 @@ class CustomJSONRenderer(JSONRenderer):
                 response['message'] = 'Operation successful'
 
         # Render the final response
-        return super().render(response, accepted_media_type, renderer_context)
+        with timing_render():
+            return self.encode(response, accepted_media_type, renderer_context)
+
+    def encode(self, data, accepted_media_type=None, renderer_context=None):
+        # indented output (e.g. for the browsable API) is left to the stdlib encoder
+        if self.fast and self.get_indent(accepted_media_type, renderer_context or {}) is None:
+            try:
+                content = orjson.dumps(data, default=encode_default, option=ORJSON_OPTIONS)
+            except orjson.JSONEncodeError:
+                # e.g. integers wider than 64 bits, which the stdlib encoder can still handle
+                pass
+            else:
+                for separator, escaped in LINE_SEPARATORS:
+                    if separator in content:
+                        content = content.replace(separator, escaped)
+                return content
+        return super().render(data, accepted_media_type, renderer_context)
 
     def extract_error_message(self, data):
         """Extract and return the first error message from the data."""
@@ -0,0 +1,130 @@
+from collections import defaultdict
+from decimal import Decimal
+from operator import itemgetter
+
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from api.v1.serializers import ProductBatchSerializer, SaleItemSerializer, SaleTransactionSerializer, \
+    ProductSerializer, ProductUnitSerializer
+from app.models import ProductSale
+
+
+class ValuesReader:
+    """
+    Renders rows of a values() queryset exactly as `serializer_class` renders model instances.
+
+    Lookups and converters are worked out once from the serializer's fields, so rendering a row
+    is one dict comprehension instead of a serializer walking every field of a model instance.
+    Fields that are not plain columns are given in `computed` as functions of the row, fed by
+    the columns in `extra_lookups`.
+    """
+
+    def __init__(self, serializer_class, computed=None, extra_lookups=()):
+        computed = computed or {}
+        self.lookups = list(extra_lookups)
+        self.columns = []
+        for name, field in serializer_class().fields.items():
+            if name in computed:
+                read = computed[name]
+            else:
+                lookup = field.source.replace(".", "__")
+                self.lookups.append(lookup)
+                read = itemgetter(lookup)
+            # related fields render the primary key values() already gives, and ModelFields
+            # (generated columns) the raw value; nested serializers and method fields, which
+            # need the model instance, are rendered by `computed`
+            if isinstance(field, (serializers.RelatedField, serializers.ModelField, serializers.BaseSerializer,
+                                  serializers.SerializerMethodField)):
+                convert = None
+            else:
+                convert = field.to_representation
+            self.columns.append((name, read, convert))
+
+    def values(self, queryset):
+        return queryset.prefetch_related(None).values(*dict.fromkeys(self.lookups))
+
+    def render(self, row):
+        data = {}
+        for name, read, convert in self.columns:
+            value = read(row)
+            data[name] = value if value is None or convert is None else convert(value)
+        return data
+
+    def render_rows(self, rows):
+        return [self.render(row) for row in rows]
+
+
+def final_selling_price(row):
+    return row["selling_total"] - (row["selling_total"] * Decimal(row["percentage_discount"] / 100))
+
+
+batch_reader = ValuesReader(ProductBatchSerializer)
+
+product_reader = ValuesReader(ProductSerializer)
+
+product_unit_reader = ValuesReader(
+    ProductUnitSerializer,
+    computed={"out_of_stock": lambda row: row["stock__current_batch"] is None},
+    extra_lookups=("stock__current_batch",),
+)
+
+sale_item_reader = ValuesReader(
+    SaleItemSerializer,
+    computed={
+        "product_unit": lambda row: f"{row['product_unit__unit__name']}(s) of {row['product_unit__product__name']}",
+        "profit": lambda row: (row["selling_price"] - row["cost_price"]) * row["quantity"],
+        "total_selling_price": lambda row: row["selling_price"] * row["quantity"],
+        "total_cost_price": lambda row: row["cost_price"] * row["quantity"],
+    },
+    extra_lookups=("product_unit__unit__name", "product_unit__product__name"),
+)
+
+
+class SaleReader(ValuesReader):
+    """Sales with their lines, read with one query for the sales and one for all their lines."""
+
+    def __init__(self):
+        super().__init__(
+            SaleTransactionSerializer,
+            computed={
+                "sales": itemgetter("sales"),
+                "actual_selling_price": itemgetter("selling_total"),
+                "actual_profit": lambda row: row["selling_total"] - row["cost_total"],
+                "total_cost_price": itemgetter("cost_total"),
+                "final_profit": lambda row: final_selling_price(row) - row["cost_total"],
+                "final_selling_price": final_selling_price,
+            },
+            extra_lookups=("selling_total", "cost_total"),
+        )
+
+    def lines(self, rows):
+        queryset = ProductSale.objects.filter(sale_id__in=[row["id"] for row in rows]).order_by("id")
+        return sale_item_reader.values(queryset)
+
+    def attach(self, rows, lines):
+        sales = defaultdict(list)
+        for line in lines:
+            sales[line["sale"]].append(sale_item_reader.render(line))
+        for row in rows:
+            row["sales"] = sales[row["id"]]
+        return super().render_rows(rows)
+
+    def render_rows(self, rows):
+        return self.attach(rows, self.lines(rows))
+
+    async def arender_rows(self, rows):
+        # the one reader that reads more than the page, so the one with an async render
+        return self.attach(rows, [line async for line in self.lines(rows)])
+
+
+sale_reader = SaleReader()
+
+
+def list_response(view, reader):
+    """Serve a list action of `view` through `reader` instead of its serializer."""
+    queryset = reader.values(view.filter_queryset(view.get_queryset()))
+    page = view.paginate_queryset(queryset)
+    if page is None:
+        return Response(reader.render_rows(list(queryset)))
+    return view.get_paginated_response(reader.render_rows(page))
@@ -5,7 +5,24 @@ from django.db.models import Q
 from django.utils import timezone
 from rest_framework import serializers
 
-from app.models import Unit, Category, Product, ProductUnit, ProductBatch, ProductSale, SaleTransaction
+from app.checkout import checkout, CheckoutError
+from app.intake import find_duplicates, receive_batches
+from app.models import Unit, Category, Product, ProductUnit, ProductBatch, ProductSale, SaleTransaction, \
+    ReorderSuggestion, StockMovement
+
+REPORT_DAYS = 30
+
+
+def resolve_product_units(items):
+    """Replace the product unit ids of `items` with ProductUnit instances fetched in one query."""
+    ids = {item["product_unit"] for item in items}
+    product_units = ProductUnit.objects.select_related("product", "unit").in_bulk(ids)
+    missing = ids - product_units.keys()
+    if missing:
+        raise serializers.ValidationError(f'Invalid pk "{min(missing)}" - object does not exist.')
+    for item in items:
+        item["product_unit"] = product_units[item["product_unit"]]
+    return items
 
 
 class UnitSerializer(serializers.ModelSerializer):
@@ -73,18 +90,24 @@ class MutateProductBatchSerializer(serializers.ModelSerializer):
 class ProductUnitSerializer(serializers.ModelSerializer):
     unit = serializers.CharField(source="unit.name")
     product = serializers.CharField(source="product.name")
-    out_of_stock = serializers.BooleanField(read_only=True)
+    out_of_stock = serializers.SerializerMethodField()
     selling_price = serializers.DecimalField(read_only=True, max_digits=10, decimal_places=2,
-                                             source="current_batch.selling_price")
+                                             source="stock.selling_price")
     cost_price = serializers.DecimalField(read_only=True, max_digits=10, decimal_places=2,
-                                             source="current_batch.cost_price")
-    quantity_left = serializers.IntegerField(read_only=True, source="current_batch.quantity")
+                                             source="stock.cost_price")
+    quantity_left = serializers.IntegerField(read_only=True, source="stock.quantity_left")
+    total_quantity = serializers.IntegerField(read_only=True, source="stock.total_quantity")
 
 
     class Meta:
         model = ProductUnit
         exclude = ("deleted_at", "restored_at", )
 
+    def get_out_of_stock(self, obj) -> bool:
+        # a product unit without a stock snapshot has never been stocked
+        stock = getattr(obj, "stock", None)
+        return stock is None or stock.out_of_stock
+
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
@@ -102,10 +125,8 @@ class CreateProductBatchSerializer(serializers.ModelSerializer):
     def validate(self, attrs):
         if attrs["selling_price"] < attrs["cost_price"]:
             raise serializers.ValidationError("Selling price cannot be less than cost price")
-        if not self.instance:
-            last_2_minutes = timezone.now() - timedelta(minutes=2)
-            if ProductBatch.objects.filter(**attrs, created_at__range=(last_2_minutes, timezone.now())).exists():
-                raise serializers.ValidationError("Try again in 2 minutes")
+        if not self.instance and find_duplicates([attrs]):
+            raise serializers.ValidationError("Try again in 2 minutes")
         return attrs
 
     def create(self, validated_data):
@@ -115,6 +136,34 @@ class CreateProductBatchSerializer(serializers.ModelSerializer):
         instance = instance.update(**validated_data)
         return instance
 
+class ProductBatchRowSerializer(serializers.ModelSerializer):
+    product_unit = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = ProductBatch
+        fields = ("product_unit", "quantity", "cost_price", "selling_price")
+        extra_kwargs = {"cost_price": {"required": True}, "selling_price": {"required": True}}
+
+    def validate(self, attrs):
+        if attrs["selling_price"] < attrs["cost_price"]:
+            raise serializers.ValidationError("Selling price cannot be less than cost price")
+        return attrs
+
+class BulkCreateProductBatchSerializer(serializers.Serializer):
+    batches = ProductBatchRowSerializer(many=True, allow_empty=False)
+
+    def validate_batches(self, value):
+        resolve_product_units(value)
+        duplicates = find_duplicates(value)
+        if duplicates:
+            raise serializers.ValidationError(f"Batch {duplicates[0] + 1} was already received, "
+                                              f"try again in 2 minutes")
+        return value
+
+    def create(self, validated_data):
+        return receive_batches(validated_data["batches"])
+
 class UpdateProductBatchSerializer(CreateProductBatchSerializer):
     unit = None
     product = None
@@ -127,23 +176,12 @@ class UpdateProductBatchSerializer(CreateProductBatchSerializer):
 
 
 class CreateSaleItemSerializer(serializers.ModelSerializer):
-    product_unit = serializers.PrimaryKeyRelatedField(queryset=ProductUnit.objects.all())
-    quantity = serializers.IntegerField()
+    product_unit = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
     class Meta:
         model = ProductSale
         fields = ("product_unit", "quantity", )
 
-    def validate(self, attrs):
-        product_unit = attrs["product_unit"]
-        if product_unit.out_of_stock:
-            raise serializers.ValidationError(f"{product_unit} is out of stock")
-        product_quantity = product_unit.current_batch.quantity
-        if product_quantity < attrs["quantity"]:
-            raise serializers.ValidationError(f"Only {product_quantity} {product_unit} is available")
-        attrs["cost_price"] = product_unit.current_batch.cost_price
-        attrs["selling_price"] = product_unit.current_batch.selling_price
-        return attrs
-
 
 
 
@@ -167,12 +205,15 @@ class CreateSaleTransactionSerializer(serializers.ModelSerializer):
         model = SaleTransaction
         fields = ("sales", "percentage_discount", )
 
+    def validate_sales(self, value):
+        return resolve_product_units(value)
+
     def create(self, validated_data):
         sales = validated_data.pop("sales")
-        transaction = SaleTransaction.objects.create(**validated_data)
-        for sale in sales:
-            ProductSale.objects.create(**sale, sale=transaction)
-        return transaction
+        try:
+            return checkout(sales, **validated_data)
+        except CheckoutError as e:
+            raise serializers.ValidationError({"sales": [str(e)]})
 
 class SaleTransactionSerializer(serializers.ModelSerializer):
     sales = SaleItemSerializer(many=True, source="productsale_set", read_only=True)
@@ -183,4 +224,80 @@ class SaleTransactionSerializer(serializers.ModelSerializer):
     final_selling_price = serializers.DecimalField(read_only=True, max_digits=10, decimal_places=2)
     class Meta:
         model = SaleTransaction
-        exclude = ("deleted_at", "restored_at", )
\ No newline at end of file
+        exclude = ("deleted_at", "restored_at", )
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+
+class ReportQuerySerializer(ExportQuerySerializer):
+    period = serializers.ChoiceField(choices=("hour", "day", "month"), default="day")
+    group_by = serializers.ChoiceField(choices=("product_unit", "category"), required=False)
+
+    def validate(self, attrs):
+        attrs.setdefault("end", timezone.localdate())
+        attrs.setdefault("start", attrs["end"] - timedelta(days=REPORT_DAYS - 1))
+        if attrs["start"] > attrs["end"]:
+            raise serializers.ValidationError("start must not be after end")
+        return attrs
+
+
+class SalesReportSerializer(serializers.Serializer):
+    period = serializers.ReadOnlyField(source="report_period")
+    product_unit = serializers.IntegerField(required=False)
+    category = serializers.IntegerField(required=False)
+    category_name = serializers.CharField(required=False, source="category__name")
+    units_sold = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    cost = serializers.DecimalField(max_digits=14, decimal_places=2)
+    discounted_revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    profit = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class InventoryValuationQuerySerializer(serializers.Serializer):
+    group_by = serializers.ChoiceField(choices=("product", "category", "unit"), default="product")
+    product = serializers.IntegerField(required=False)
+    category = serializers.IntegerField(required=False)
+    unit = serializers.IntegerField(required=False)
+
+
+class InventoryValuationSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False, source="group_id")
+    name = serializers.CharField(required=False, source="group_name")
+    on_hand = serializers.IntegerField()
+    cost_value = serializers.DecimalField(max_digits=14, decimal_places=2)
+    retail_value = serializers.DecimalField(max_digits=14, decimal_places=2)
+    potential_profit = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class ReorderSuggestionSerializer(serializers.ModelSerializer):
+    product = serializers.CharField(source="product_unit.product.name")
+    unit = serializers.CharField(source="product_unit.unit.name", default=None)
+
+    class Meta:
+        model = ReorderSuggestion
+        fields = ("product_unit", "product", "unit", "status", "on_hand", "velocity", "days_of_cover",
+                  "reorder_quantity", "computed_at")
+
+
+class StockLevelQuerySerializer(serializers.Serializer):
+    at = serializers.DateTimeField(required=False)
+    product_unit = serializers.IntegerField(required=False)
+
+
+class StockLevelSerializer(serializers.Serializer):
+    product_unit = serializers.IntegerField()
+    quantity = serializers.IntegerField()
+
+
+class StockMovementQuerySerializer(ExportQuerySerializer):
+    product_unit = serializers.IntegerField(required=False)
+    kind = serializers.ChoiceField(choices=StockMovement.KINDS, required=False)
+
+
+class StockMovementSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockMovement
+        fields = ("id", "product_unit", "batch", "sale", "kind", "quantity", "created_at")
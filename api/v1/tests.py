@@ -1,3 +1,610 @@
-from django.test import TestCase
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+from api.management.commands.benchmark_renderer import sale_rows
+from api.renderers import CustomJSONRenderer
+from api.v1.readers import batch_reader, sale_reader, product_unit_reader
+from api.v1.serializers import ProductBatchSerializer, SaleTransactionSerializer, ProductUnitSerializer
+from api.v1.views import ProductBatchAPI, SaleAPI, ProductUnitListAPI
+
+from app.checkout import checkout, CheckoutError
+from app.idempotency import request_hash
+from app.models import Unit, Category, Product, ProductUnit, ProductBatch, SaleTransaction, IdempotencyKey, \
+    BatchFingerprint, ProductUnitStock, ProductSale, DailySalesRollup
+from app.search import index_products
+from core.cache import get_response_cache
+from core.metrics import RequestMetrics, fingerprint, registry
+
+PAGE_SIZES = range(1, 101)
+
+
+def seed_catalog(size):
+    categories = Category.objects.bulk_create(Category(name=f"category {i}") for i in range(size))
+    units = Unit.objects.bulk_create(Unit(name=f"unit {i}") for i in range(size))
+    product_units = []
+    for i in range(size):
+        product = Product.objects.create(name=f"product {i}", category=categories[i])
+        product_unit = ProductUnit.objects.create(product=product, unit=units[i])
+        ProductBatch.objects.create(product_unit=product_unit, quantity=1000, cost_price=1, selling_price=2)
+        product_units.append(product_unit)
+    return product_units
+
+
+class QueryBudgetTests(TestCase):
+    """Every list endpoint must serve a page with a fixed number of queries, whatever its size."""
+
+    # queries per page, including the count of page number paginated endpoints
+    budgets = {
+        "/api/v1/units/": 2,
+        "/api/v1/categories/": 2,
+        "/api/v1/product-batches/": 1,
+        "/api/v1/sales/": 2,
+        "/api/v1/products": 2,
+        "/api/v1/product-units": 2,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        product_units = seed_catalog(max(PAGE_SIZES))
+        for product_unit in product_units:
+            checkout([{"product_unit": product_unit, "quantity": 1},
+                      {"product_unit": product_units[0], "quantity": 1}])
+
+    def get_page(self, url, page_size):
+        with mock.patch.object(PageNumberPagination, "page_size", page_size):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {"page_size": page_size})
+        self.assertEqual(response.status_code, 200, url)
+        self.assertEqual(len(response.json()["data"]["results"]), page_size, url)
+        return len(queries)
+
+    def test_list_pages_stay_within_query_budget(self):
+        for url, budget in self.budgets.items():
+            for page_size in PAGE_SIZES:
+                with self.subTest(url=url, page_size=page_size):
+                    self.assertLessEqual(self.get_page(url, page_size), budget)
+
+
+class ProductUnitStockTests(TestCase):
+    def out_of_stock(self):
+        rows = self.client.get("/api/v1/product-units").json()["data"]["results"]
+        return {row["id"]: row["out_of_stock"] for row in rows}
+
+    def test_product_units_without_stock_snapshot_are_out_of_stock(self):
+        stocked, unstocked = seed_catalog(2)
+        ProductBatch.objects.filter(product_unit=unstocked).update(quantity=0)
+        ProductUnitStock.global_objects.filter(product_unit=unstocked).delete()
+
+        self.assertEqual(self.out_of_stock(), {stocked.pk: False, unstocked.pk: True})
+
+
+class ResponseCacheTests(TransactionTestCase):
+    def setUp(self):
+        get_response_cache().clear()
+
+    def test_cached_list_is_invalidated_by_writes(self):
+        product_unit = seed_catalog(2)[0]
+
+        first = self.client.get("/api/v1/product-units")
+        second = self.client.get("/api/v1/product-units")
+        self.assertEqual((first["X-Cache"], second["X-Cache"]), ("MISS", "HIT"))
+        self.assertEqual(first.content, second.content)
+        not_modified = self.client.get("/api/v1/product-units", HTTP_IF_NONE_MATCH=second["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+
+        checkout([{"product_unit": product_unit, "quantity": 10}])
+
+        after_sale = self.client.get("/api/v1/product-units", HTTP_IF_NONE_MATCH=second["ETag"])
+        self.assertEqual(after_sale.status_code, 200)
+        self.assertEqual(after_sale["X-Cache"], "MISS")
+        self.assertNotEqual(after_sale["ETag"], second["ETag"])
+        quantities = {row["id"]: row["total_quantity"] for row in after_sale.json()["data"]["results"]}
+        self.assertEqual(quantities[product_unit.pk], 990)
+
+    def test_requests_differing_in_query_are_cached_apart(self):
+        seed_catalog(2)
+        self.client.get("/api/v1/units/", {"search": "unit 0"})
+        response = self.client.get("/api/v1/units/", {"search": "unit 1"})
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual([unit["name"] for unit in response.json()["data"]["results"]], ["unit 1"])
+
+
+class SalesReportTests(TestCase):
+    def test_report_reads_rollups_in_one_query(self):
+        product_units = seed_catalog(3)
+        for product_unit in product_units:
+            checkout([{"product_unit": product_unit, "quantity": 2}])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/v1/reports/", {"group_by": "category"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        rows = response.json()["data"]
+        self.assertEqual([row["category_name"] for row in rows], ["category 0", "category 1", "category 2"])
+        self.assertEqual({(row["units_sold"], row["revenue"], row["profit"]) for row in rows}, {(2, "4.00", "2.00")})
+
+
+class InventoryValuationTests(TestCase):
+    def test_valuation_is_one_grouped_query(self):
+        product_units = seed_catalog(3)
+        ProductBatch.objects.create(product_unit=product_units[0], quantity=10, cost_price="1.50",
+                                    selling_price="2.25")
+        checkout([{"product_unit": product_units[1], "quantity": 1000}])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/v1/reports/inventory-valuation/", {"group_by": "category"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        data = response.json()["data"]
+        self.assertEqual([(row["name"], row["on_hand"], row["cost_value"], row["retail_value"],
+                           row["potential_profit"]) for row in data["results"]],
+                         [("category 0", 1010, "1015.00", "2022.50", "1007.50"),
+                          ("category 2", 1000, "1000.00", "2000.00", "1000.00")])
+        self.assertEqual(data["totals"]["potential_profit"], "2007.50")
+
+        filtered = self.client.get("/api/v1/reports/inventory-valuation/", {"unit": product_units[2].unit_id})
+        self.assertEqual([row["name"] for row in filtered.json()["data"]["results"]], ["product 2"])
+
+
+class ExportTests(TestCase):
+    def export(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_batches_are_streamed_as_csv_and_ndjson(self):
+        product_units = seed_catalog(2)
+        batches = ProductBatch.objects.order_by("id")
+
+        response = self.client.get("/api/v1/export/batches.csv")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="batches.csv"')
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,product_unit_id,quantity,cost_price,selling_price,profit,total_profit,created_at")
+        self.assertEqual([line.split(",")[:7] for line in lines[1:]],
+                         [[str(batch.pk), str(batch.product_unit_id), "1000", "1.00", "2.00", "1.00", "1000.00"]
+                          for batch in batches])
+
+        rows = [json.loads(line) for line in self.export("/api/v1/export/batches.ndjson").splitlines()]
+        self.assertEqual([(row["id"], row["product_unit_id"], row["quantity"], row["total_profit"]) for row in rows],
+                         [(batch.pk, unit.pk, 1000, "1000.00") for batch, unit in zip(batches, product_units)])
+
+    def test_rows_are_filtered_by_day(self):
+        product_unit = seed_catalog(1)[0]
+        old = checkout([{"product_unit": product_unit, "quantity": 1}])
+        new = checkout([{"product_unit": product_unit, "quantity": 2}])
+        SaleTransaction.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=3))
+        today = timezone.localdate()
+
+        for params, sales in (({"start": today.isoformat()}, [new]),
+                              ({"end": (today - timedelta(days=1)).isoformat()}, [old]),
+                              ({"start": (today - timedelta(days=3)).isoformat()}, [old, new])):
+            with self.subTest(params=params):
+                lines = self.export("/api/v1/export/sales.ndjson", params).splitlines()
+                self.assertEqual([json.loads(line)["id"] for line in lines], [sale.pk for sale in sales])
+
+        response = self.client.get("/api/v1/export/sales.csv", {"start": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_dataset_or_format_is_not_found(self):
+        for url in ("/api/v1/export/customers.csv", "/api/v1/export/sales.xlsx"):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        grains, flour = Category.objects.create(name="grains"), Category.objects.create(name="rice goods")
+        bag, sack = Unit.objects.create(name="bag"), Unit.objects.create(name="rice sack")
+        for name, category, unit in (("brown rice", grains, bag), ("oats", flour, bag), ("rice flour", grains, bag),
+                                     ("beans", grains, sack), ("rice", grains, bag), ("maize", grains, bag)):
+            ProductUnit.objects.create(product=Product.objects.create(name=name, category=category), unit=unit)
+
+    def search(self, term, **params):
+        response = self.client.get("/api/v1/products", {"search": term, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["data"]
+
+    def test_matches_are_ranked_by_where_the_term_is_found(self):
+        for term in ("rice", "RICE ", "ri"):
+            with self.subTest(term=term):
+                self.assertEqual([product["name"] for product in self.search(term)["results"]],
+                                 ["rice", "rice flour", "brown rice", "oats", "beans"])
+
+    def test_short_terms_match_categories_and_units(self):
+        self.assertEqual([product["name"] for product in self.search("oo")["results"]], ["oats"])
+        self.assertEqual([product["name"] for product in self.search("ck")["results"]], ["beans"])
+        self.assertEqual(self.search("zz")["count"], 0)
+
+    def test_every_match_can_be_paged_through(self):
+        Product.objects.bulk_create(Product(name=f"item {i:03}") for i in range(250))
+        index_products(Product.objects.values_list("id", flat=True))
+
+        data = self.search("item", page=13)
+        self.assertEqual(data["count"], 250)
+        self.assertEqual([product["name"] for product in data["results"]], [f"item {i:03}" for i in range(240, 250)])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry.clear()
+
+    def test_requests_are_recorded_per_view(self):
+        seed_catalog(3)
+        self.client.get("/api/v1/product-batches/")
+        self.client.get("/api/v1/product-batches/")
+
+        metrics = self.client.get("/metrics").content.decode()
+        labels = 'method="GET",view="api/v1/product-batches/$"'
+        self.assertIn(f'http_request_sql_queries_bucket{{{labels},le="1"}} 2', metrics)
+        self.assertIn(f"http_request_duration_seconds_count{{{labels}}} 2", metrics)
+        self.assertIn(f"http_request_render_duration_seconds_count{{{labels}}} 2", metrics)
+        self.assertIn(f'http_response_size_bytes_bucket{{{labels},le="+Inf"}} 2', metrics)
+
+    @override_settings(METRICS={"ENABLED": True, "SLOW_REQUEST_SECONDS": 1e-9, "TOKEN": ""})
+    def test_slow_requests_are_logged(self):
+        seed_catalog(1)
+        with self.assertLogs("core.middleware", "WARNING") as logs:
+            self.client.get("/api/v1/units/")
+        self.assertIn("Slow request GET /api/v1/units/ (api/v1/units/$)", logs.output[0])
+
+    def test_duplicate_queries_are_fingerprinted(self):
+        units = Unit.objects.bulk_create(Unit(name=f"unit {i}") for i in range(3))
+        metrics = RequestMetrics(keep_sql=True)
+        with connection.execute_wrapper(metrics):
+            for unit in units:
+                Unit.objects.get(pk=unit.pk)
+            Unit.objects.count()
+        self.assertEqual(metrics.queries, 4)
+        [(shape, count)] = metrics.duplicates().items()
+        self.assertEqual(count, 3)
+        self.assertIn('"app_unit"."id" = ?) LIMIT ?', shape)
+
+    def test_sampled_statements_are_bounded(self):
+        units = Unit.objects.bulk_create(Unit(name=f"unit {i}") for i in range(3))
+        metrics = RequestMetrics(keep_sql=True, sample_size=2)
+        with connection.execute_wrapper(metrics):
+            for unit in units:
+                Unit.objects.get(pk=unit.pk)
+            Unit.objects.count()
+            Unit.objects.exists()
+        self.assertEqual(metrics.queries, 5)
+        self.assertEqual(len(metrics.statements), 2)
+        self.assertEqual(list(metrics.duplicates().values()), [3])
+
+    @override_settings(METRICS={"ENABLED": True, "SLOW_REQUEST_SECONDS": 1.0, "TOKEN": "s3cret"})
+    def test_metrics_require_the_token_when_one_is_set(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret").status_code, 200)
+
+    def test_fingerprint_collapses_literals_and_in_lists(self):
+        self.assertEqual(fingerprint("SELECT * FROM t WHERE a = 'x''y' AND b IN (1, 2,3) AND c = %s"),
+                         "SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ?")
+
+
+class RendererTests(SimpleTestCase):
+    def render(self, data, fast, status=200):
+        renderer = CustomJSONRenderer()
+        renderer.fast = fast
+        return renderer.render(data, "application/json", {"response": Response(status=status)})
+
+    def test_fast_path_matches_stdlib_encoder(self):
+        payloads = [
+            (sale_rows(20, raw=True), 200),
+            (sale_rows(20, raw=False), 200),
+            ({1: "int key", "separator": "a\u2028b", "big": 2 ** 70}, 200),
+            ({"sales": [{"quantity": ["Ensure this value is greater than or equal to 1."]}]}, 400),
+        ]
+        for data, status in payloads:
+            with self.subTest(status=status):
+                fast, stdlib = self.render(data, True, status), self.render(data, False, status)
+                self.assertEqual(json.loads(fast), json.loads(stdlib))
+                self.assertNotIn("\u2028".encode(), fast)
+
+
+class ReaderParityTests(TestCase):
+    """The values() readers of the hot list endpoints must render exactly what the serializers do."""
+
+    @classmethod
+    def setUpTestData(cls):
+        product_units = seed_catalog(4)
+        ProductBatch.objects.create(product_unit=product_units[0], quantity=3, cost_price="1.25",
+                                    selling_price="2.99")
+        checkout([{"product_unit": product_units[0], "quantity": 1001},
+                  {"product_unit": product_units[1], "quantity": 7}], percentage_discount="12.5")
+        checkout([{"product_unit": product_units[2], "quantity": 1}])
+        # never stocked, without a stock snapshot
+        ProductBatch.objects.filter(product_unit=product_units[3]).update(quantity=0)
+        ProductUnitStock.global_objects.filter(product_unit=product_units[3]).delete()
+
+    def assertRendersLikeSerializer(self, reader, serializer_class, queryset):
+        expected = serializer_class(queryset, many=True).data
+        rendered = reader.render_rows(list(reader.values(queryset)))
+        self.assertEqual([list(row) for row in rendered], [list(row) for row in expected])
+        self.assertEqual(rendered, expected)
+
+    def test_batch_reader(self):
+        self.assertRendersLikeSerializer(batch_reader, ProductBatchSerializer, ProductBatchAPI.queryset.all())
+
+    def test_sale_reader(self):
+        self.assertRendersLikeSerializer(sale_reader, SaleTransactionSerializer, SaleAPI.queryset.all())
+
+    def test_product_unit_reader(self):
+        self.assertRendersLikeSerializer(product_unit_reader, ProductUnitSerializer,
+                                         ProductUnitListAPI.queryset.all())
+
+
+class AsyncReadTests(TestCase):
+    """The async read endpoints must answer exactly what their sync twins do."""
+
+    @classmethod
+    def setUpTestData(cls):
+        product_units = seed_catalog(25)
+        for product_unit in product_units[:12]:
+            checkout([{"product_unit": product_unit, "quantity": 3},
+                      {"product_unit": product_units[-1], "quantity": 1}])
+        # product unit 13 has never been stocked and has no stock snapshot
+        ProductBatch.objects.filter(product_unit=product_units[13]).update(quantity=0)
+        ProductUnitStock.global_objects.filter(product_unit=product_units[13]).delete()
+        cls.sale = SaleTransaction.objects.order_by("id").first()
+
+    def assertSameData(self, sync_url, async_url, params=None):
+        expected = self.client.get(sync_url, params)
+        response = self.client.get(async_url, params)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.json(), json.loads(expected.content.decode().replace(sync_url, async_url)))
+
+    def test_catalog_pages_match(self):
+        for params in ({}, {"page": 2}, {"page": "last"}, {"page": 9}, {"search": "product 1"}):
+            with self.subTest(params=params):
+                self.assertSameData("/api/v1/products", "/api/v1/async/products", params)
+
+    def test_product_unit_pages_match(self):
+        for params in ({}, {"page": 2}, {"search": "unit 3"}, {"search": "unit 13"}):
+            with self.subTest(params=params):
+                self.assertSameData("/api/v1/product-units", "/api/v1/async/product-units", params)
+
+    def test_sales_history_and_detail_match(self):
+        first = self.client.get("/api/v1/async/sales/", {"page_size": 5}).json()["data"]
+        expected = self.client.get("/api/v1/sales/", {"page_size": 5}).json()["data"]
+        self.assertEqual(first["results"], expected["results"])
+        self.assertEqual(first["next"], expected["next"].replace("/api/v1/sales/", "/api/v1/async/sales/"))
+        second = self.client.get(first["next"]).json()["data"]
+        self.assertEqual([sale["id"] for sale in second["results"]],
+                         [sale["id"] for sale in self.client.get(expected["next"]).json()["data"]["results"]])
+        back = self.client.get(second["previous"]).json()["data"]
+        self.assertEqual(back["results"], first["results"])
+
+        self.assertSameData(f"/api/v1/sales/{self.sale.pk}/", f"/api/v1/async/sales/{self.sale.pk}/")
+        self.assertSameData("/api/v1/sales/0/", "/api/v1/async/sales/0/")
+
+
+class IdempotentCheckoutTests(TestCase):
+    def setUp(self):
+        self.product_unit = seed_catalog(1)[0]
+
+    def sell(self, key, quantity=2):
+        return self.client.post("/api/v1/sales/", {"sales": [{"product_unit": self.product_unit.pk,
+                                                              "quantity": quantity}]},
+                                content_type="application/json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def stock(self):
+        return ProductBatch.objects.filter(product_unit=self.product_unit).values_list("quantity", flat=True).get()
+
+    def test_retry_replays_the_first_sale_without_touching_stock(self):
+        first = self.sell("terminal-1:0001")
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.sell("terminal-1:0001")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.content), (201, first.content))
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertFalse([query for query in queries if "app_productbatch" in query["sql"]])
+        self.assertEqual(SaleTransaction.objects.count(), 1)
+        self.assertEqual(self.stock(), 998)
+
+    def test_rejections_are_replayed_and_keys_are_bound_to_their_request(self):
+        rejected = self.sell("terminal-1:0002", quantity=5000)
+        self.assertEqual(rejected.status_code, 400)
+        self.assertEqual(self.sell("terminal-1:0002", quantity=5000).content, rejected.content)
+        self.assertEqual(self.sell("terminal-1:0002", quantity=1).status_code, 422)
+        self.assertEqual(self.stock(), 1000)
+
+    def test_unfinished_claims_wait_and_linked_sales_are_replayed(self):
+        IdempotencyKey.objects.create(key="terminal-1:0003", request_hash=request_hash(
+            {"sales": [{"product_unit": self.product_unit.pk, "quantity": 2}]}))
+        self.assertEqual(self.sell("terminal-1:0003").status_code, 409)
+
+        # the sale committed but the request died before storing its response
+        sale = checkout([{"product_unit": self.product_unit, "quantity": 2}], idempotency_key="terminal-1:0003")
+        response = self.sell("terminal-1:0003")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["data"]["id"], sale.pk)
+        self.assertEqual(self.stock(), 998)
+
+    def test_stale_claims_are_taken_over_by_a_retry(self):
+        body = {"sales": [{"product_unit": self.product_unit.pk, "quantity": 2}]}
+        # the request holding the claim died before it could release it
+        IdempotencyKey.objects.create(key="terminal-1:0004", request_hash=request_hash(body),
+                                      claimed_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(self.sell("terminal-1:0004", quantity=3).status_code, 422)
+
+        retry = self.sell("terminal-1:0004")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(self.sell("terminal-1:0004").content, retry.content)
+        self.assertEqual(self.stock(), 998)
+
+        # had it only been slow, it cannot make a second sale with the key
+        with self.assertRaisesMessage(CheckoutError, "already made with this Idempotency-Key"), transaction.atomic():
+            checkout([{"product_unit": self.product_unit, "quantity": 2}], idempotency_key="terminal-1:0004")
+        self.assertEqual(self.stock(), 998)
+
+    def test_expired_keys_are_pruned_and_reusable(self):
+        self.sell("terminal-1:0005")
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(hours=25))
+        self.assertEqual(self.sell("terminal-1:0005").status_code, 201)
+        self.assertEqual(self.stock(), 996)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(hours=25))
+        call_command("prune_idempotency_keys", stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class BatchIntakeTests(TestCase):
+    def setUp(self):
+        self.product_unit = seed_catalog(1)[0]
+
+    def batch(self, quantity=10):
+        return {"product_unit": self.product_unit.pk, "quantity": quantity, "cost_price": "1.00",
+                "selling_price": "2.00"}
+
+    def receive(self, quantity=10):
+        return self.client.post("/api/v1/product-batches/", self.batch(quantity), content_type="application/json")
+
+    def receive_bulk(self, *quantities):
+        return self.client.post("/api/v1/product-batches/bulk/", {"batches": [self.batch(q) for q in quantities]},
+                                content_type="application/json")
+
+    def test_repeated_batches_are_rejected_until_they_expire(self):
+        self.assertEqual(self.receive().status_code, 201)
+        self.assertEqual(self.receive().status_code, 400)
+        self.assertEqual(self.receive(quantity=11).status_code, 201)
+
+        BatchFingerprint.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.receive().status_code, 201)
+        self.assertEqual(ProductBatch.objects.filter(product_unit=self.product_unit).count(), 4)
+
+    def test_rejected_bulk_intake_releases_its_other_rows(self):
+        self.assertEqual(self.receive().status_code, 201)
+        response = self.receive_bulk(20, 10)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Batch 2 was already received", response.content.decode())
+        self.assertEqual(self.receive_bulk(20, 20).status_code, 400)
+
+        self.assertEqual(self.receive_bulk(20).status_code, 201)
+        self.assertEqual(BatchFingerprint.objects.count(), 2)
+
+    def test_expired_fingerprints_are_purged(self):
+        self.receive()
+        self.receive(quantity=11)
+        BatchFingerprint.objects.filter(pk=BatchFingerprint.objects.values("pk")[:1]).update(
+            expires_at=timezone.now() - timedelta(seconds=1))
+        call_command("purge_batch_fingerprints", batch_size=1, stdout=StringIO())
+        self.assertEqual(BatchFingerprint.objects.count(), 1)
+
+    def test_partially_invalid_payload_receives_nothing(self):
+        rows = [self.batch(20), dict(self.batch(30), selling_price="0.50"), dict(self.batch(40), product_unit=999)]
+        for batches in (rows[:2], [rows[0], rows[2]]):
+            with self.subTest(batches=batches):
+                response = self.client.post("/api/v1/product-batches/bulk/", {"batches": batches},
+                                            content_type="application/json")
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(ProductBatch.objects.filter(product_unit=self.product_unit).count(), 1)
+        self.assertFalse(BatchFingerprint.objects.exists())
+
+    def test_batch_repeated_within_the_payload_is_rejected(self):
+        response = self.receive_bulk(20, 30, 20)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Batch 3 was already received", response.content.decode())
+        self.assertEqual(ProductBatch.objects.filter(product_unit=self.product_unit).count(), 1)
+
+    def test_duplicates_of_a_payload_are_looked_up_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.receive_bulk(*range(1, 101))
+        self.assertEqual(response.status_code, 201)
+        lookups = [query for query in queries if BatchFingerprint._meta.db_table in query["sql"]]
+        self.assertEqual(len(lookups), 1)
+
+    def test_csv_file_is_imported_in_chunks(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", newline="") as file:
+            file.write("product_unit,quantity,cost_price,selling_price\n")
+            file.writelines(f"{self.product_unit.pk},{quantity},1.00,2.00\n" for quantity in range(1, 6))
+            file.flush()
+            out = StringIO()
+            call_command("import_batches", file.name, chunk_size=2, stdout=out)
+            self.assertIn("Received 5 batches", out.getvalue())
+
+            with self.assertRaisesMessage(CommandError, "Row 1 was already received"):
+                call_command("import_batches", file.name, chunk_size=2, stdout=StringIO())
+        self.assertEqual(ProductBatch.objects.filter(product_unit=self.product_unit).count(), 6)
+
+    def test_csv_import_names_the_first_invalid_row(self):
+        rows = [f"{self.product_unit.pk},4,1.00,2.00", f"{self.product_unit.pk},5,3.00,2.00",
+                f"{self.product_unit.pk},six,1.00,2.00", "999,7,1.00,2.00"]
+        for lines, message in ((rows[:2], "Row 2: Selling price cannot be less than cost price"),
+                               (rows[::2], "Row 2: quantity:"),
+                               (rows[::3], "Row 2: product unit 999 does not exist")):
+            with self.subTest(message=message), tempfile.NamedTemporaryFile("w", suffix=".csv") as file:
+                file.write("product_unit,quantity,cost_price,selling_price\n" + "\n".join(lines) + "\n")
+                file.flush()
+                with self.assertRaisesMessage(CommandError, message):
+                    call_command("import_batches", file.name, chunk_size=1, stdout=StringIO())
+        self.assertEqual(ProductBatch.objects.filter(product_unit=self.product_unit).count(), 1)
+
+
+class StockLedgerAPITests(TestCase):
+    def test_stock_levels_and_movements_follow_intake_and_sales(self):
+        product_unit = seed_catalog(1)[0]
+        self.client.post("/api/v1/product-batches/bulk/", {"batches": [
+            {"product_unit": product_unit.pk, "quantity": 50, "cost_price": "1.00", "selling_price": "2.00"}]},
+            content_type="application/json")
+        self.client.post("/api/v1/sales/", {"sales": [{"product_unit": product_unit.pk, "quantity": 30}]},
+                         content_type="application/json")
+
+        levels = self.client.get("/api/v1/reports/stock-levels/", {"product_unit": product_unit.pk}).json()
+        self.assertEqual(levels["data"]["results"], [{"product_unit": product_unit.pk, "quantity": 1020}])
+        movements = self.client.get("/api/v1/reports/stock-movements/", {"product_unit": product_unit.pk,
+                                                                         "kind": "receipt"}).json()
+        self.assertEqual([row["quantity"] for row in movements["data"]["results"]], [50, 1000])
+        self.assertEqual(self.client.get("/api/v1/reports/stock-movements/", {"kind": "gift"}).status_code, 400)
+
+
+class BenchmarkTests(TestCase):
+    def benchmark(self, **options):
+        stdout = StringIO()
+        call_command("benchmark_api", requests=3, warmup=1, in_place=True, yes_i_mean_it=True, stdout=stdout,
+                     stderr=StringIO(), **options)
+        return stdout.getvalue()
+
+    def test_benchmark_refuses_to_seed_the_configured_database(self):
+        with self.assertRaisesMessage(CommandError, "needs DEBUG on or --yes-i-mean-it"):
+            call_command("benchmark_api", in_place=True, stdout=StringIO(), stderr=StringIO())
+        self.assertFalse(Product.objects.exists())
+
+    def test_seeded_sales_are_rolled_up(self):
+        self.benchmark(products=10, batches=20, sale_lines=30, scenario=["catalog"])
+        self.assertEqual(DailySalesRollup.objects.aggregate(total=Sum("units_sold"))["total"],
+                         ProductSale.objects.aggregate(total=Sum("quantity"))["total"])
+
+    def test_benchmark_fails_on_regressions_against_its_baseline(self):
+        with tempfile.NamedTemporaryFile("w+", suffix=".json") as file:
+            output = self.benchmark(products=30, batches=90, sale_lines=60, save_baseline=file.name)
+            self.assertIn("seeded 30 products, 90 batches and 60 sale lines", output)
+            baseline = json.load(file)
+            self.assertEqual(set(baseline), {"catalog", "search", "batch_intake", "checkout", "sales_history"})
+            self.assertEqual(baseline["sales_history"]["max_queries"], 2)
+            self.assertEqual({result["errors"] for result in baseline.values()}, {0})
+
+            baseline["sales_history"]["max_queries"] = 1
+            file.seek(0)
+            file.truncate()
+            json.dump(baseline, file)
+            file.flush()
+            with self.assertRaisesMessage(CommandError, "sales_history max_queries 1 -> 2"):
+                self.benchmark(no_seed=True, scenario=["sales_history"], baseline=file.name, tolerance=100)
@@ -4,7 +4,9 @@ from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 from rest_framework.routers import SimpleRouter
 
-from api.v1.views import UnitAPI, CategoryAPI, ProductBatchAPI, SaleAPI, ProductAPI, ProductListAPI, ProductUnitListAPI
+from api.v1.views import UnitAPI, CategoryAPI, ProductBatchAPI, SaleAPI, ProductAPI, ProductListAPI, ProductUnitListAPI, \
+    ExportAPI, CacheStatsAPI, ReportAPI, InventoryValuationAPI, ReorderSuggestionListAPI, AsyncProductListAPI, \
+    AsyncProductUnitListAPI, AsyncSaleListAPI, AsyncSaleAPI, StockLevelAPI, StockMovementListAPI
 
 swagger_view = get_schema_view(
     info=openapi.Info(
@@ -32,6 +34,18 @@ urlpatterns = [
         name="swagger_redocs",
     ),
     path("products", ProductListAPI.as_view()),
-    path("product-units", ProductUnitListAPI.as_view())
+    path("product-units", ProductUnitListAPI.as_view()),
+    path("export/<str:dataset>.<str:file_format>", ExportAPI.as_view()),
+    path("cache-stats", CacheStatsAPI.as_view()),
+    path("reports/", ReportAPI.as_view()),
+    path("reports/inventory-valuation/", InventoryValuationAPI.as_view()),
+    path("reports/reorder-suggestions/", ReorderSuggestionListAPI.as_view()),
+    path("reports/stock-levels/", StockLevelAPI.as_view()),
+    path("reports/stock-movements/", StockMovementListAPI.as_view()),
+    # async twins of the hot read endpoints, for ASGI deployments
+    path("async/products", AsyncProductListAPI.as_view()),
+    path("async/product-units", AsyncProductUnitListAPI.as_view()),
+    path("async/sales/", AsyncSaleListAPI.as_view()),
+    path("async/sales/<int:pk>/", AsyncSaleAPI.as_view()),
 ]
 urlpatterns += router.urls
@@ -1,18 +1,41 @@
 import logging
+from datetime import timedelta
 
 from django.db import transaction
-from django.db.models import Q
+from django.http import StreamingHttpResponse, HttpResponse
+from django.views import View
+from django.utils import timezone
+from django.db.models import Q, Prefetch
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, NotFound
 from rest_framework.generics import ListAPIView
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from api.cache import CachedListMixin
+from api.pagination import KeysetPagination, AsyncPageNumberPagination
+from api.renderers import CustomJSONRenderer
+from api.v1.readers import batch_reader, sale_reader, list_response, product_reader, product_unit_reader
 from api.v1.serializers import UnitSerializer, CategorySerializer, ProductBatchSerializer, SaleTransactionSerializer, \
     CreateSaleTransactionSerializer, CreateProductBatchSerializer, UpdateProductBatchSerializer, ProductSerializer, \
-    MutateProductSerializer, ProductUnitSerializer
-from app.models import Unit, Category, ProductBatch, SaleTransaction, Product, ProductUnit
+    MutateProductSerializer, ProductUnitSerializer, ExportQuerySerializer, \
+    BulkCreateProductBatchSerializer, ReportQuerySerializer, SalesReportSerializer, \
+    InventoryValuationQuerySerializer, InventoryValuationSerializer, ReorderSuggestionSerializer, \
+    StockLevelQuerySerializer, StockLevelSerializer, StockMovementQuerySerializer, StockMovementSerializer
+from app.export import DATASETS, FORMATS, export_lines, day_start
+from app.idempotency import request_hash, claim_key, complete_key, release_key
+from app.ledger import stock_at
+from app.models import Unit, Category, ProductBatch, SaleTransaction, Product, ProductUnit, ProductSale, \
+    ReorderSuggestion, StockMovement
+from app.rollups import sales_report
+from app.search import search_products
+from app.valuation import inventory_valuation, valuation_totals
+from core.cache import get_response_cache
 
 search_query  = openapi.Parameter(
     name="search",
@@ -21,6 +44,13 @@ search_query  = openapi.Parameter(
     type=openapi.TYPE_STRING
 )
 
+idempotency_key_header = openapi.Parameter(
+    name="Idempotency-Key",
+    in_=openapi.IN_HEADER,
+    description="Unique key of the sale, retries with the same key get the first response back",
+    type=openapi.TYPE_STRING
+)
+
 product_query = openapi.Parameter(
     name="product",
     in_=openapi.IN_QUERY,
@@ -35,9 +65,80 @@ unit_query = openapi.Parameter(
     type=openapi.TYPE_NUMBER
 )
 
-class UnitAPI(viewsets.ModelViewSet):
+start_query = openapi.Parameter(
+    name="start",
+    in_=openapi.IN_QUERY,
+    description="First day (YYYY-MM-DD)",
+    type=openapi.TYPE_STRING
+)
+
+end_query = openapi.Parameter(
+    name="end",
+    in_=openapi.IN_QUERY,
+    description="Last day (YYYY-MM-DD)",
+    type=openapi.TYPE_STRING
+)
+
+period_query = openapi.Parameter(
+    name="period",
+    in_=openapi.IN_QUERY,
+    description="hour, day or month",
+    type=openapi.TYPE_STRING
+)
+
+group_by_query = openapi.Parameter(
+    name="group_by",
+    in_=openapi.IN_QUERY,
+    description="product_unit or category",
+    type=openapi.TYPE_STRING
+)
+
+valuation_group_query = openapi.Parameter(
+    name="group_by",
+    in_=openapi.IN_QUERY,
+    description="product, category or unit",
+    type=openapi.TYPE_STRING
+)
+
+category_query = openapi.Parameter(
+    name="category",
+    in_=openapi.IN_QUERY,
+    description="Category id",
+    type=openapi.TYPE_NUMBER
+)
+
+at_query = openapi.Parameter(
+    name="at",
+    in_=openapi.IN_QUERY,
+    description="Point in time (ISO 8601), defaults to now",
+    type=openapi.TYPE_STRING
+)
+
+product_unit_query = openapi.Parameter(
+    name="product_unit",
+    in_=openapi.IN_QUERY,
+    description="Product unit id",
+    type=openapi.TYPE_NUMBER
+)
+
+kind_query = openapi.Parameter(
+    name="kind",
+    in_=openapi.IN_QUERY,
+    description="receipt, sale, adjustment or return",
+    type=openapi.TYPE_STRING
+)
+
+status_query = openapi.Parameter(
+    name="status",
+    in_=openapi.IN_QUERY,
+    description="out_of_stock or low",
+    type=openapi.TYPE_STRING
+)
+
+class UnitAPI(CachedListMixin, viewsets.ModelViewSet):
     queryset = Unit.objects.order_by("name")
     serializer_class = UnitSerializer
+    cache_models = ("Unit",)
     http_method_names = ("get", "post", "patch",)
 
     def filter_queryset(self, queryset):
@@ -65,7 +166,7 @@ class UnitAPI(viewsets.ModelViewSet):
         manual_parameters=[search_query]
     )
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        return self.cached(super().list, request, *args, **kwargs)
 
     @swagger_auto_schema(
         operation_summary="retrieve unit",
@@ -73,9 +174,10 @@ class UnitAPI(viewsets.ModelViewSet):
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
-class CategoryAPI(viewsets.ModelViewSet):
+class CategoryAPI(CachedListMixin, viewsets.ModelViewSet):
     queryset = Category.objects.order_by("name")
     serializer_class = CategorySerializer
+    cache_models = ("Category",)
     http_method_names = ("get", "post", "patch",)
 
     def filter_queryset(self, queryset):
@@ -103,7 +205,7 @@ class CategoryAPI(viewsets.ModelViewSet):
         manual_parameters=[search_query]
     )
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        return self.cached(super().list, request, *args, **kwargs)
 
     @swagger_auto_schema(
         operation_summary="retrieve product category",
@@ -112,9 +214,10 @@ class CategoryAPI(viewsets.ModelViewSet):
         return super().retrieve(request, *args, **kwargs)
 
 class ProductBatchAPI(viewsets.ModelViewSet):
-    queryset = ProductBatch.objects.order_by("-id")
+    queryset = ProductBatch.objects.select_related("product_unit__product", "product_unit__unit").order_by("-id")
     serializer_class = ProductBatchSerializer
     # permission_classes = (IsAuthenticated,)
+    pagination_class = KeysetPagination
     http_method_names = ("post", "patch", "get")
 
     def filter_queryset(self, queryset):
@@ -138,6 +241,19 @@ class ProductBatchAPI(viewsets.ModelViewSet):
         batch = serializer.save()
         return Response(data=self.serializer_class(batch).data, status=201)
 
+    @swagger_auto_schema(
+        request_body=BulkCreateProductBatchSerializer,
+        operation_summary="create product batches in bulk"
+    )
+    @action(detail=False, methods=["post"], url_path="bulk")
+    @transaction.atomic
+    def bulk_create(self, request, *args, **kwargs):
+        serializer = BulkCreateProductBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(data=serializer.errors, status=400)
+        batches = serializer.save()
+        return Response(data=self.serializer_class(batches, many=True).data, status=201)
+
     @swagger_auto_schema(
         request_body=UpdateProductBatchSerializer,
         operation_summary="update product batch"
@@ -156,7 +272,7 @@ class ProductBatchAPI(viewsets.ModelViewSet):
         manual_parameters=[product_query, unit_query]
     )
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        return list_response(self, batch_reader)
 
     @swagger_auto_schema(
         operation_summary="retrieve product batch",
@@ -165,22 +281,72 @@ class ProductBatchAPI(viewsets.ModelViewSet):
         return super().retrieve(request, *args, **kwargs)
 
 class SaleAPI(viewsets.ModelViewSet):
-    queryset = SaleTransaction.objects.order_by("-id")
+    queryset = SaleTransaction.objects.with_totals().prefetch_related(
+        Prefetch("productsale_set", queryset=ProductSale.objects.select_related("product_unit__product",
+                                                                                "product_unit__unit")
+                 .order_by("id"))
+    ).order_by("-id")
     serializer_class = SaleTransactionSerializer
+    pagination_class = KeysetPagination
     http_method_names = ("post", "get")
 
     @swagger_auto_schema(
         request_body=CreateSaleTransactionSerializer,
-        operation_summary="create sale transaction"
+        operation_summary="create sale transaction",
+        manual_parameters=[idempotency_key_header]
     )
-    @transaction.atomic
     def create(self, request, *args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return self.create_sale(request)
+        if not 0 < len(key) <= 255:
+            return Response(data={"detail": "Idempotency-Key must be 1 to 255 characters"}, status=400)
+        digest = request_hash(request.data)
+        record = claim_key(key, digest)
+        if record is not None:
+            return self.replay(record, digest)
+        try:
+            response = self.create_sale(request, idempotency_key=key)
+        except APIException as e:
+            # e.g. the checkout found too little stock, an outcome to replay like any other
+            response = self.handle_exception(e)
+        except Exception:
+            release_key(key)
+            raise
+        if response.status_code >= 500:
+            release_key(key)
+        else:
+            complete_key(key, response.status_code, response.data)
+        return response
+
+    def create_sale(self, request, **save_kwargs):
         serializer = CreateSaleTransactionSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(data=serializer.errors, status=400)
-        sale = serializer.save()
+        sale = serializer.save(**save_kwargs)
+        sale = self.get_queryset().get(pk=sale.pk)
         return Response(data=self.serializer_class(sale).data, status=201)
 
+    def replay(self, record, digest):
+        """Answer a retry with the outcome of the request that first used its key."""
+        if record.request_hash != digest:
+            return Response(data={"detail": "Idempotency-Key was already used for a different sale"},
+                            status=422)
+        if record.status_code is not None:
+            response = Response(data=record.response, status=record.status_code)
+        elif record.sale_id is not None:
+            # the sale was made but its response was never stored
+            rows = list(sale_reader.values(self.get_queryset().filter(pk=record.sale_id)))
+            if not rows:
+                return Response(data={"detail": "The sale made with this Idempotency-Key was deleted"},
+                                status=410)
+            response = Response(data=sale_reader.render_rows(rows)[0], status=201)
+        else:
+            return Response(data={"detail": "A request with this Idempotency-Key is still being processed"},
+                            status=409)
+        response["Idempotent-Replayed"] = "true"
+        return response
+
     @swagger_auto_schema(
         operation_summary="list sale transactions"
     )
@@ -191,7 +357,7 @@ class SaleAPI(viewsets.ModelViewSet):
         operation_summary="list sale transactions"
     )
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        return list_response(self, sale_reader)
 
 
 class ProductAPI(viewsets.ModelViewSet):
@@ -202,11 +368,7 @@ class ProductAPI(viewsets.ModelViewSet):
     def filter_queryset(self, queryset):
         search = self.request.query_params.get("search")
         if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) |
-                Q(category__name__icontains=search)|
-                Q(productunit__unit__name__icontains=search))
-
+            queryset = search_products(queryset, search)
         return queryset
 
     @swagger_auto_schema(
@@ -249,9 +411,10 @@ class ProductAPI(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
-class ProductUnitListAPI(ListAPIView):
-    queryset = ProductUnit.objects.order_by("product_id")
+class ProductUnitListAPI(CachedListMixin, ListAPIView):
+    queryset = ProductUnit.objects.select_related("product", "unit", "stock").order_by("product_id")
     serializer_class = ProductUnitSerializer
+    cache_models = ("ProductUnit", "Product", "Unit", "ProductUnitStock")
     http_method_names = ("get",)
 
     def filter_queryset(self, queryset):
@@ -268,18 +431,20 @@ class ProductUnitListAPI(ListAPIView):
 
     )
     def get(self, request, *args, **kwargs):
-        return super().get(request, *args, **kwargs)
+        return self.cached(super().get, request, *args, **kwargs)
 
 
-class ProductListAPI(ListAPIView):
+class ProductListAPI(CachedListMixin, ListAPIView):
     queryset = Product.objects.order_by("name")
     serializer_class = ProductSerializer
+    # search matches category and unit names too
+    cache_models = ("Product", "Category", "Unit", "ProductUnit")
     http_method_names = ("get",)
 
     def filter_queryset(self, queryset):
         search = self.request.query_params.get("search")
         if search:
-            queryset = queryset.filter(name__icontains=search)
+            queryset = search_products(queryset, search)
         return queryset
 
     @swagger_auto_schema(
@@ -288,4 +453,207 @@ class ProductListAPI(ListAPIView):
         tags=["products"]
     )
     def get(self, request, *args, **kwargs):
-        return super().get(request, *args, **kwargs)
\ No newline at end of file
+        return self.cached(super().get, request, *args, **kwargs)
+
+
+class ExportAPI(APIView):
+    http_method_names = ("get",)
+
+    @swagger_auto_schema(
+        operation_summary="export sales, sale-lines or batches as ndjson or csv",
+        manual_parameters=[start_query, end_query],
+        tags=["exports"]
+    )
+    def get(self, request, dataset, file_format):
+        if dataset not in DATASETS or file_format not in FORMATS:
+            return Response(data={"detail": "Export not found"}, status=404)
+        serializer = ExportQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(data=serializer.errors, status=400)
+        response = StreamingHttpResponse(export_lines(dataset, file_format, **serializer.validated_data),
+                                         content_type=FORMATS[file_format])
+        response["Content-Disposition"] = f'attachment; filename="{dataset}.{file_format}"'
+        return response
+
+
+class ReportAPI(APIView):
+    http_method_names = ("get",)
+
+    @swagger_auto_schema(
+        operation_summary="units sold, revenue, cost and profit per period, from the sales rollups",
+        manual_parameters=[start_query, end_query, period_query, group_by_query],
+        tags=["reports"]
+    )
+    def get(self, request):
+        serializer = ReportQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(data=serializer.errors, status=400)
+        rows = sales_report(**serializer.validated_data)
+        return Response(data=SalesReportSerializer(rows, many=True).data, status=200)
+
+
+class InventoryValuationAPI(CachedListMixin, APIView):
+    http_method_names = ("get",)
+    # every batch write refreshes the stock snapshot, which bumps ProductUnitStock
+    cache_models = ("ProductUnitStock", "ProductUnit", "Product", "Category", "Unit")
+
+    @swagger_auto_schema(
+        operation_summary="quantity, cost value, retail value and potential profit of the stock on hand",
+        manual_parameters=[valuation_group_query, product_query, category_query, unit_query],
+        tags=["reports"]
+    )
+    def get(self, request):
+        return self.cached(self.value_inventory, request)
+
+    def value_inventory(self, request):
+        serializer = InventoryValuationQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(data=serializer.errors, status=400)
+        filters = dict(serializer.validated_data)
+        group_by = filters.pop("group_by")
+        rows = list(inventory_valuation(group_by, **filters))
+        return Response(data={
+            "as_of": timezone.now(),
+            "group_by": group_by,
+            "totals": InventoryValuationSerializer(valuation_totals(rows)).data,
+            "results": InventoryValuationSerializer(rows, many=True).data,
+        }, status=200)
+
+
+class ReorderSuggestionListAPI(CachedListMixin, ListAPIView):
+    queryset = ReorderSuggestion.objects.select_related("product_unit__product", "product_unit__unit") \
+        .order_by("days_of_cover", "product_unit_id")
+    serializer_class = ReorderSuggestionSerializer
+    http_method_names = ("get",)
+    cache_models = ("ReorderSuggestion", "Product", "Unit")
+
+    def filter_queryset(self, queryset):
+        status = self.request.query_params.get("status")
+        if status:
+            queryset = queryset.filter(status=status)
+        return queryset
+
+    @swagger_auto_schema(
+        operation_summary="product units to reorder, soonest to run out first",
+        operation_description="Written by the compute_reorders command from the daily sales rollups; sales "
+                              "recorded before the rollups count once rebuild_rollups has covered their days.",
+        manual_parameters=[status_query],
+        tags=["reports"]
+    )
+    def get(self, request, *args, **kwargs):
+        return self.cached(super().get, request, *args, **kwargs)
+
+
+class StockLevelAPI(APIView):
+    http_method_names = ("get",)
+
+    @swagger_auto_schema(
+        operation_summary="stock of each product unit at a point in time, from the stock ledger",
+        manual_parameters=[at_query, product_unit_query],
+        tags=["reports"]
+    )
+    def get(self, request):
+        serializer = StockLevelQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(data=serializer.errors, status=400)
+        at = serializer.validated_data.get("at") or timezone.now()
+        product_unit = serializer.validated_data.get("product_unit")
+        levels = stock_at(at, None if product_unit is None else [product_unit])
+        rows = [{"product_unit": pk, "quantity": quantity} for pk, quantity in sorted(levels.items())]
+        return Response(data={"as_of": at, "results": StockLevelSerializer(rows, many=True).data}, status=200)
+
+
+class StockMovementListAPI(ListAPIView):
+    queryset = StockMovement.objects.all()
+    serializer_class = StockMovementSerializer
+    pagination_class = KeysetPagination
+    http_method_names = ("get",)
+
+    def filter_queryset(self, queryset):
+        serializer = StockMovementQuerySerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        filters = serializer.validated_data
+        if "product_unit" in filters:
+            queryset = queryset.filter(product_unit_id=filters["product_unit"])
+        if "kind" in filters:
+            queryset = queryset.filter(kind=filters["kind"])
+        if "start" in filters:
+            queryset = queryset.filter(created_at__gte=day_start(filters["start"]))
+        if "end" in filters:
+            queryset = queryset.filter(created_at__lt=day_start(filters["end"] + timedelta(days=1)))
+        return queryset
+
+    @swagger_auto_schema(
+        operation_summary="stock ledger movements, newest first",
+        manual_parameters=[product_unit_query, kind_query, start_query, end_query],
+        tags=["reports"]
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class CacheStatsAPI(APIView):
+    http_method_names = ("get",)
+
+    @swagger_auto_schema(
+        operation_summary="response cache hits, misses, evictions and size",
+        tags=["cache"]
+    )
+    def get(self, request):
+        cache = get_response_cache()
+        if cache is None:
+            return Response(data={"detail": "Response cache is disabled"}, status=404)
+        return Response(data=cache.stats(), status=200)
+
+
+class AsyncReadView(View):
+    """
+    Read only endpoint with an async handler, so under ASGI a request waiting on the database
+    holds no worker thread. Responses are rendered exactly like those of the DRF views.
+
+    Subclasses define `async def read(self, request, *args, **kwargs)`, taking the DRF request and
+    the URL arguments and returning the response data; APIExceptions it raises become error
+    responses.
+    """
+    http_method_names = ["get"]
+    renderer = CustomJSONRenderer()
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            data, status = await self.read(Request(request), *args, **kwargs), 200
+        except APIException as e:
+            data, status = {"detail": e.detail}, e.status_code
+        content = self.renderer.render(data, "application/json", {"response": Response(status=status)})
+        return HttpResponse(content, status=status, content_type="application/json")
+
+
+class AsyncProductListAPI(AsyncReadView):
+    async def read(self, request):
+        queryset = ProductListAPI.queryset.all()
+        search = request.query_params.get("search")
+        if search:
+            queryset = search_products(queryset, search)
+        return await AsyncPageNumberPagination().apaginate(request, queryset, product_reader)
+
+
+class AsyncProductUnitListAPI(AsyncReadView):
+    async def read(self, request):
+        queryset = ProductUnitListAPI.queryset.all()
+        search = request.query_params.get("search")
+        if search:
+            queryset = queryset.filter(Q(unit__name__icontains=search) | Q(product__name__icontains=search))
+        return await AsyncPageNumberPagination().apaginate(request, queryset, product_unit_reader)
+
+
+class AsyncSaleListAPI(AsyncReadView):
+    async def read(self, request):
+        return await KeysetPagination().apaginate(request, SaleAPI.queryset.all(), sale_reader)
+
+
+class AsyncSaleAPI(AsyncReadView):
+    async def read(self, request, pk):
+        try:
+            row = await sale_reader.values(SaleAPI.queryset.filter(pk=pk)).aget()
+        except SaleTransaction.DoesNotExist:
+            raise NotFound("No SaleTransaction matches the given query.")
+        return (await sale_reader.arender_rows([row]))[0]
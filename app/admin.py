@@ -2,7 +2,8 @@ from django.contrib import admin
 
 # Register your models here.
 
-from app.models import Product, SaleTransaction, ProductUnit, ProductBatch, Category, Unit, ProductSale
+from app.models import Product, SaleTransaction, ProductUnit, ProductBatch, Category, Unit, ProductSale, \
+    ProductUnitStock
 
 admin.site.register(Product)
 admin.site.register(SaleTransaction)
@@ -11,3 +12,4 @@ admin.site.register(ProductBatch)
 admin.site.register(Category)
 admin.site.register(Unit)
 admin.site.register(ProductSale)
+admin.site.register(ProductUnitStock)
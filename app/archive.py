@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from app.models import ProductBatch, ProductSale, SaleTransaction, ProductUnitStock, IdempotencyKey, \
+    ArchivedProductBatch, ArchivedProductSale, ArchivedSaleTransaction
+
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 1000
+
+
+def archivable(model, cutoff):
+    """Rows of `model` soft deleted before `cutoff` that nothing left in the hot tables points at."""
+    rows = model.deleted_objects.filter(deleted_at__lt=cutoff)
+    if model is SaleTransaction:
+        rows = rows.filter(~Exists(ProductSale.global_objects.filter(sale=OuterRef("pk"))))
+    elif model is ProductBatch:
+        rows = rows.filter(~Exists(ProductSale.global_objects.filter(batch=OuterRef("pk"))),
+                           ~Exists(ProductUnitStock.global_objects.filter(current_batch=OuterRef("pk"))))
+    return rows
+
+
+def delete_rows(model, ids):
+    # bypasses the soft delete of the queryset, and the deletion collector with its signals
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+
+
+def archive_chunk(model, archive, cutoff, batch_size):
+    """Move up to `batch_size` archivable rows of `model` into `archive` and return how many moved."""
+    fields = [field.attname for field in archive._meta.concrete_fields if field.name != "archived_at"]
+    with transaction.atomic():
+        # rows being restored are locked by their restore and skipped
+        rows = list(archivable(model, cutoff).select_for_update(skip_locked=True, of=("self",))
+                    .order_by("deleted_at", "id").values(*fields)[:batch_size])
+        if not rows:
+            return 0
+        ids = [row["id"] for row in rows]
+        archive.objects.bulk_create([archive(**row) for row in rows])
+        if model is SaleTransaction:
+            IdempotencyKey.objects.filter(sale_id__in=ids).update(sale=None)
+        delete_rows(model, ids)
+    return len(rows)
+
+
+def archive_deleted(days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move the sale lines, sales and batches soft deleted more than `days` days ago into their
+    archive tables, and return {model name: rows moved}.
+
+    Every chunk of `batch_size` rows is moved in its own short transaction, so the hot tables
+    are never locked for long. Sale lines go first, as sales and batches are only moved once no
+    sale line points at them.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    moved = {}
+    for model, archive in ((ProductSale, ArchivedProductSale), (SaleTransaction, ArchivedSaleTransaction),
+                           (ProductBatch, ArchivedProductBatch)):
+        moved[model.__name__] = 0
+        while True:
+            count = archive_chunk(model, archive, cutoff, batch_size)
+            if not count:
+                break
+            moved[model.__name__] += count
+    return moved
@@ -0,0 +1,173 @@
+import random
+import time
+from collections import defaultdict, deque
+
+from django.db import transaction, OperationalError
+from django.db.models import Case, When, Value, F, PositiveIntegerField
+from django.utils import timezone
+
+from app.ledger import record_movements, sales
+from app.models import ProductBatch, ProductSale, SaleTransaction, IdempotencyKey
+from app.rollups import record_sales
+from app.stock import refresh_stock
+
+
+CHECKOUT_RETRIES = 10
+RETRY_BACKOFF = 0.01
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class InsufficientStock(CheckoutError):
+    pass
+
+
+class StockConflict(CheckoutError):
+    pass
+
+
+class KeyAlreadyUsed(CheckoutError):
+    pass
+
+
+def lock_batches(product_unit_ids):
+    """Lock the in-stock batches of the given product units, grouped per unit in FIFO order."""
+    batches = defaultdict(deque)
+    queryset = (ProductBatch.objects.select_for_update()
+                .filter(product_unit_id__in=product_unit_ids, quantity__gt=0)
+                .order_by("product_unit_id", "created_at", "id"))
+    for batch in queryset:
+        batches[batch.product_unit_id].append(batch)
+    return batches
+
+
+def allocate(product_unit, quantity, batches):
+    """
+    Take `quantity` off `batches`, oldest first, and return one sale line per batch drawn from.
+
+    Exhausted batches are popped off the front of `batches`; the caller must have checked
+    that they hold enough stock.
+    """
+    lines = []
+    while quantity:
+        batch = batches[0]
+        taken = min(batch.quantity, quantity)
+        batch.quantity -= taken
+        quantity -= taken
+        lines.append(ProductSale(product_unit=product_unit, batch=batch, quantity=taken,
+                                 cost_price=batch.cost_price, selling_price=batch.selling_price))
+        if not batch.quantity:
+            batches.popleft()
+    return lines
+
+
+def check_available(product_unit, quantity, batches):
+    available = sum(batch.quantity for batch in batches)
+    if not available:
+        raise InsufficientStock(f"{product_unit} is out of stock")
+    if available < quantity:
+        raise InsufficientStock(f"Only {available} {product_unit} is available")
+
+
+def allocate_line(line):
+    """
+    Allocate a ProductSale saved on its own to the batches of its product unit, oldest first, or
+    to its `batch` when it names one, and return the further lines it spills over into.
+
+    `line` is given the first batch drawn from and the quantity taken from it, and the prices of
+    that batch unless it carries its own; every further batch gets a line of its own. Stock is
+    checked before anything is written. Must run in a transaction, the batches stay locked.
+    """
+    batches = lock_batches([line.product_unit_id])[line.product_unit_id]
+    if line.batch_id is not None:
+        batches = deque(batch for batch in batches if batch.pk == line.batch_id)
+    check_available(line.product_unit, line.quantity, batches)
+    lines = allocate(line.product_unit, line.quantity, batches)
+    if not lines:
+        return []
+    first, *rest = lines
+    line.batch, line.quantity = first.batch, first.quantity
+    if not (line.cost_price or line.selling_price):
+        line.cost_price, line.selling_price = first.cost_price, first.selling_price
+    return rest
+
+
+def deduct_stock(deductions):
+    """
+    Take `deductions` ({batch id: quantity}) off the batches in one conditional UPDATE.
+
+    A batch is only decremented while it still holds the quantity taken from it, so stock can
+    never go negative; StockConflict is raised when another checkout got there first.
+    """
+    if not deductions:
+        return
+    deduction = Case(*(When(pk=pk, then=Value(quantity)) for pk, quantity in deductions.items()),
+                     output_field=PositiveIntegerField())
+    updated = (ProductBatch.objects.filter(pk__in=deductions, quantity__gte=deduction)
+               .update(quantity=F("quantity") - deduction, updated_at=timezone.now()))
+    if updated != len(deductions):
+        raise StockConflict("Stock changed during checkout, try again")
+
+
+def is_retryable(error):
+    if isinstance(error, StockConflict):
+        return True
+    cause = error.__cause__
+    # serialization failure / deadlock on postgres, busy database on sqlite
+    code = getattr(cause, "pgcode", None) or getattr(cause, "sqlstate", None)
+    return code in ("40001", "40P01") or "locked" in str(error)
+
+
+def checkout(items, idempotency_key=None, **sale_data):
+    """
+    Record a sale of `items` (dicts of product_unit and quantity) and deduct the stock.
+
+    Each line is spread over the batches of its product unit oldest first, so it may turn
+    into several ProductSale rows, one per batch it drew from. Every deduction is worked out
+    in memory against the locked batches, so a sale costs the same number of queries whatever
+    the number of lines.
+
+    The checkout runs in its own transaction and is retried when it loses a race for the
+    stock; inside a caller's transaction it runs once and leaves retrying to the caller.
+    A claimed `idempotency_key` is linked to the sale in that same transaction.
+    """
+    if transaction.get_connection().in_atomic_block:
+        return _checkout(items, idempotency_key, **sale_data)
+    for attempt in range(CHECKOUT_RETRIES):
+        try:
+            with transaction.atomic():
+                return _checkout(items, idempotency_key, **sale_data)
+        except (StockConflict, OperationalError) as e:
+            if attempt == CHECKOUT_RETRIES - 1 or not is_retryable(e):
+                raise
+        time.sleep(RETRY_BACKOFF * 2 ** attempt * random.random())
+
+
+def _checkout(items, idempotency_key=None, **sale_data):
+    product_unit_ids = {item["product_unit"].pk for item in items}
+    batches = lock_batches(product_unit_ids)
+    lines = []
+    deductions = defaultdict(int)
+    for item in items:
+        product_unit, quantity = item["product_unit"], item["quantity"]
+        unit_batches = batches[product_unit.pk]
+        check_available(product_unit, quantity, unit_batches)
+        for line in allocate(product_unit, quantity, unit_batches):
+            deductions[line.batch.pk] += line.quantity
+            lines.append(line)
+
+    deduct_stock(deductions)
+    sale = SaleTransaction.objects.create(**sale_data)
+    for line in lines:
+        line.sale = sale
+    ProductSale.objects.bulk_create(lines)
+    record_movements(sales(lines))
+    # a request that outlived its claim finds the key linked by the retry that took it over
+    if idempotency_key is not None and not IdempotencyKey.objects.filter(
+            pk=idempotency_key, sale__isnull=True).update(sale=sale):
+        raise KeyAlreadyUsed("A sale was already made with this Idempotency-Key")
+    refresh_stock(product_unit_ids)
+    record_sales(lines)
+    return sale
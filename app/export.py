@@ -0,0 +1,87 @@
+import csv
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from app.models import SaleTransaction, ProductSale, ProductBatch
+
+CHUNK_SIZE = 2000
+
+DATASETS = {
+    "sales": (
+        SaleTransaction.objects.with_totals,
+        ("id", "created_at", "percentage_discount", "selling_total", "cost_total"),
+    ),
+    "sale-lines": (
+        ProductSale.objects.all,
+        ("id", "sale_id", "product_unit_id", "batch_id", "quantity", "cost_price", "selling_price", "created_at"),
+    ),
+    "batches": (
+        ProductBatch.objects.all,
+        ("id", "product_unit_id", "quantity", "cost_price", "selling_price", "profit", "total_profit",
+         "created_at"),
+    ),
+}
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def for_each_day(start, end, work):
+    """Call `work` with each day from `start` to `end` and return what it returned."""
+    results = []
+    day = start
+    while day <= end:
+        # one transaction per day keeps locks short on a live database
+        with transaction.atomic():
+            results.append(work(day))
+        day += timedelta(days=1)
+    return results
+
+
+def export_rows(dataset, start=None, end=None):
+    """Return the field names of `dataset` and an iterator over its rows created between two dates."""
+    get_queryset, fields = DATASETS[dataset]
+    queryset = get_queryset()
+    if start:
+        queryset = queryset.filter(created_at__gte=day_start(start))
+    if end:
+        queryset = queryset.filter(created_at__lt=day_start(end + timedelta(days=1)))
+    return fields, queryset.order_by("id").values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+
+
+def export_lines(dataset, file_format, start=None, end=None):
+    """
+    Yield `dataset` encoded as NDJSON or CSV, a chunk of rows at a time.
+
+    Rows are read with a server-side iterator, so memory stays flat whatever the date range.
+    """
+    fields, rows = export_rows(dataset, start, end)
+    if file_format == "csv":
+        writer = csv.writer(Echo())
+        encode = writer.writerow
+        yield encode(fields)
+    else:
+        encoder = DjangoJSONEncoder()
+        encode = lambda row: encoder.encode(dict(zip(fields, row))) + "\n"
+    chunk = []
+    for row in rows:
+        chunk.append(encode(row))
+        if len(chunk) == CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
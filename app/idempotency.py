@@ -0,0 +1,66 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from app.models import IdempotencyKey
+
+PRUNE_BATCH_SIZE = 5000
+
+
+def request_hash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def expiry():
+    return timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+
+
+def claim_key(key, digest):
+    """
+    Claim `key` for a request hashing to `digest` and return None, or return the record of the
+    earlier request that already holds it.
+
+    The claim commits on its own, so a retry arriving while the first request is still being
+    served finds it instead of racing it. An expired key is claimed afresh, and so is a claim
+    left without an outcome past its lease, by a request that died before it could release it.
+    """
+    IdempotencyKey.objects.filter(pk=key, created_at__lt=expiry()).delete()
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(key=key, request_hash=digest)
+    except IntegrityError:
+        now = timezone.now()
+        # of several retries finding the lease run out, the conditional update lets one through
+        stale = IdempotencyKey.objects.filter(
+            pk=key, request_hash=digest, status_code__isnull=True, sale__isnull=True,
+            claimed_at__lt=now - timedelta(seconds=settings.IDEMPOTENCY_CLAIM_LEASE_SECONDS),
+        )
+        if stale.update(claimed_at=now):
+            return None
+        return IdempotencyKey.objects.filter(pk=key).first()
+    return None
+
+
+def complete_key(key, status_code, data):
+    # the first outcome stands, a request whose claim was taken over cannot replace it
+    IdempotencyKey.objects.filter(pk=key, status_code__isnull=True).update(status_code=status_code, response=data)
+
+
+def release_key(key):
+    """Drop the claim of a request that failed without an outcome, so that it can be retried."""
+    IdempotencyKey.objects.filter(pk=key, sale__isnull=True).delete()
+
+
+def prune_keys(batch_size=PRUNE_BATCH_SIZE):
+    """Delete the expired keys a batch at a time, keeping each write transaction short."""
+    cutoff = expiry()
+    deleted = 0
+    while True:
+        keys = list(IdempotencyKey.objects.filter(created_at__lt=cutoff).values_list("pk", flat=True)[:batch_size])
+        if not keys:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=keys).delete()[0]
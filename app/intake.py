@@ -0,0 +1,141 @@
+import hashlib
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from app.ledger import record_movements, receipts
+from app.models import BatchFingerprint, ProductBatch, ProductUnit
+from app.stock import refresh_stock
+
+DUPLICATE_WINDOW = timedelta(minutes=2)
+BULK_BATCH_SIZE = 500
+PURGE_BATCH_SIZE = 5000
+
+
+class IntakeError(Exception):
+    pass
+
+
+def batch_key(row):
+    return row["product_unit"].pk, row["quantity"], row["cost_price"], row["selling_price"]
+
+
+def fingerprint(row):
+    product_unit_id, quantity, cost_price, selling_price = batch_key(row)
+    key = f"{product_unit_id}|{quantity}|{cost_price:.2f}|{selling_price:.2f}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def claim_fingerprints(fingerprints, now):
+    """Insert `fingerprints`, taking over expired ones, and return the set actually claimed."""
+    expires_at = now + DUPLICATE_WINDOW
+    if not (connection.features.supports_update_conflicts_with_target
+            and connection.features.can_return_rows_from_bulk_insert):
+        claimed = set()
+        for value in fingerprints:
+            _, created = BatchFingerprint.objects.get_or_create(fingerprint=value,
+                                                                defaults={"expires_at": expires_at})
+            if created or BatchFingerprint.objects.filter(fingerprint=value, expires_at__lte=now).update(
+                    expires_at=expires_at):
+                claimed.add(value)
+        return claimed
+    # one statement that inserts the new fingerprints, renews the expired ones and leaves the
+    # live ones alone, returning the first two: a unique index decides, so it holds under races
+    quote = connection.ops.quote_name
+    table = quote(BatchFingerprint._meta.db_table)
+    field = BatchFingerprint._meta.get_field("expires_at")
+    expires_at, now = field.get_db_prep_save(expires_at, connection), field.get_db_prep_save(now, connection)
+    claimed = set()
+    with connection.cursor() as cursor:
+        for start in range(0, len(fingerprints), BULK_BATCH_SIZE):
+            batch = fingerprints[start:start + BULK_BATCH_SIZE]
+            values = ", ".join(["(%s, %s)"] * len(batch))
+            params = [param for value in batch for param in (value, expires_at)]
+            cursor.execute(f"INSERT INTO {table} (fingerprint, expires_at) VALUES {values} "
+                           f"ON CONFLICT (fingerprint) DO UPDATE SET expires_at = excluded.expires_at "
+                           f"WHERE {table}.expires_at <= %s RETURNING fingerprint", params + [now])
+            claimed.update(row[0] for row in cursor.fetchall())
+    return claimed
+
+
+def find_duplicates(rows):
+    """
+    Return the indexes of the `rows` that repeat a batch received in the last 2 minutes,
+    or an earlier row of the same intake.
+
+    The fingerprints of the rows are claimed as they are checked, so of two identical intakes
+    racing each other only one gets through. When any row is a duplicate the claims are rolled
+    back, leaving the other rows of the rejected intake free to be sent again.
+    """
+    fingerprints = [fingerprint(row) for row in rows]
+    with transaction.atomic():
+        claimed = claim_fingerprints(list(dict.fromkeys(fingerprints)), timezone.now())
+        duplicates, seen = [], set()
+        for index, value in enumerate(fingerprints):
+            if value not in claimed or value in seen:
+                duplicates.append(index)
+            seen.add(value)
+        if duplicates:
+            transaction.set_rollback(True)
+    return duplicates
+
+
+def purge_fingerprints(batch_size=PURGE_BATCH_SIZE):
+    """Delete the expired fingerprints a batch at a time and return how many went."""
+    now = timezone.now()
+    deleted = 0
+    while True:
+        values = list(BatchFingerprint.objects.filter(expires_at__lte=now)
+                      .values_list("fingerprint", flat=True)[:batch_size])
+        if not values:
+            return deleted
+        deleted += BatchFingerprint.objects.filter(pk__in=values).delete()[0]
+
+
+def clean_rows(rows, first_row=1):
+    """
+    Validate raw batch rows, such as those read off a CSV file, the way the bulk intake endpoint
+    does and return them ready for receive_batches, with their product units fetched in one query.
+
+    Raises IntakeError naming the first invalid row, rows being numbered from `first_row`.
+    """
+    fields = [ProductBatch._meta.get_field(name) for name in ("quantity", "cost_price", "selling_price")]
+    cleaned = []
+    for number, row in enumerate(rows, first_row):
+        values = {}
+        for field in fields:
+            try:
+                values[field.name] = field.clean(row.get(field.name), None)
+            except ValidationError as e:
+                raise IntakeError(f"Row {number}: {field.name}: {' '.join(e.messages)}")
+        try:
+            values["product_unit"] = int(row.get("product_unit") or "")
+        except ValueError:
+            raise IntakeError(f"Row {number}: product_unit must be the id of a product unit")
+        if values["quantity"] < 1:
+            raise IntakeError(f"Row {number}: quantity must be at least 1")
+        if values["selling_price"] < values["cost_price"]:
+            raise IntakeError(f"Row {number}: Selling price cannot be less than cost price")
+        cleaned.append(values)
+    product_units = ProductUnit.objects.in_bulk({row["product_unit"] for row in cleaned})
+    for number, row in enumerate(cleaned, first_row):
+        if row["product_unit"] not in product_units:
+            raise IntakeError(f"Row {number}: product unit {row['product_unit']} does not exist")
+        row["product_unit"] = product_units[row["product_unit"]]
+    duplicates = find_duplicates(cleaned)
+    if duplicates:
+        raise IntakeError(f"Row {duplicates[0] + first_row} was already received, try again in 2 minutes")
+    return cleaned
+
+
+def receive_batches(rows):
+    """
+    Insert validated batch rows with bulk_create, record their receipts in the stock ledger and
+    refresh the stock of their product units.
+    """
+    batches = ProductBatch.objects.bulk_create((ProductBatch(**row) for row in rows), batch_size=BULK_BATCH_SIZE)
+    record_movements(receipts(batches))
+    refresh_stock({batch.product_unit_id for batch in batches})
+    return batches
@@ -0,0 +1,110 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Max, OuterRef, Subquery, Sum
+
+from app.models import ProductBatch, StockMovement, StockSnapshot
+
+BULK_BATCH_SIZE = 500
+
+
+def receipts(batches):
+    return [StockMovement(product_unit_id=batch.product_unit_id, batch_id=batch.pk, kind=StockMovement.RECEIPT,
+                          quantity=batch.quantity, created_at=batch.created_at)
+            for batch in batches if batch.quantity]
+
+
+def sales(lines):
+    return [StockMovement(product_unit_id=line.product_unit_id, batch_id=line.batch_id, sale_id=line.sale_id,
+                          kind=StockMovement.SALE, quantity=-line.quantity, created_at=line.created_at)
+            for line in lines]
+
+
+def record_movements(movements):
+    """
+    Append `movements` to the ledger with one bulk insert.
+
+    Runs in the transaction that moves the stock, so the ledger commits or rolls back with it.
+    """
+    StockMovement.objects.bulk_create(movements, batch_size=BULK_BATCH_SIZE)
+
+
+def reconcile_batch(batch_id):
+    """
+    Record an adjustment that brings the ledger balance of a batch back to its quantity, after
+    the batch was edited, deleted or restored outside a receipt or a sale.
+    """
+    product_unit_id, quantity, deleted_at = (ProductBatch.global_objects.filter(pk=batch_id)
+                                             .values_list("product_unit_id", "quantity", "deleted_at").get())
+    expected = 0 if deleted_at else quantity
+    recorded = (StockMovement.objects.filter(product_unit_id=product_unit_id, batch_id=batch_id)
+                .aggregate(total=Sum("quantity"))["total"] or 0)
+    if expected != recorded:
+        StockMovement.objects.create(product_unit_id=product_unit_id, batch_id=batch_id,
+                                     kind=StockMovement.ADJUSTMENT, quantity=expected - recorded)
+
+
+def last_snapshot_at(at=None):
+    snapshots = StockSnapshot.objects.all() if at is None else StockSnapshot.objects.filter(taken_at__lte=at)
+    return snapshots.aggregate(taken_at=Max("taken_at"))["taken_at"]
+
+
+def latest_snapshots(at, product_unit_ids=None):
+    """Return {product unit id: quantity} of the last snapshot of each product unit taken at or before `at`."""
+    snapshots = StockSnapshot.objects.filter(taken_at__lte=at)
+    if product_unit_ids is not None:
+        snapshots = snapshots.filter(product_unit_id__in=product_unit_ids)
+    latest = snapshots.filter(product_unit=OuterRef("product_unit")).order_by("-taken_at").values("taken_at")[:1]
+    return dict(snapshots.filter(taken_at=Subquery(latest)).values_list("product_unit_id", "quantity"))
+
+
+def movement_totals(after, until, product_unit_ids=None):
+    """Return {product unit id: net quantity} of the movements made after `after` and up to `until`."""
+    movements = StockMovement.objects.filter(created_at__lte=until)
+    if after is not None:
+        movements = movements.filter(created_at__gt=after)
+    if product_unit_ids is not None:
+        movements = movements.filter(product_unit_id__in=product_unit_ids)
+    return dict(movements.values("product_unit").annotate(total=Sum("quantity")).order_by()
+                .values_list("product_unit", "total"))
+
+
+def stock_at(at, product_unit_ids=None):
+    """
+    Return {product unit id: quantity} of the stock at `at`, read off the last snapshot taken
+    before it plus the movements made since.
+
+    Every snapshot covers all the product units that moved since the one before, so the last
+    snapshot of a product unit is never older than its movements up to the latest snapshot, and
+    only the movements after that one need scanning.
+    """
+    boundary = last_snapshot_at(at)
+    levels = defaultdict(int)
+    if boundary is not None:
+        levels.update(latest_snapshots(boundary, product_unit_ids))
+    for product_unit_id, total in movement_totals(boundary, at, product_unit_ids).items():
+        levels[product_unit_id] += total
+    return dict(levels)
+
+
+def take_snapshot(at):
+    """
+    Snapshot the stock at `at` of the product units that moved since the last snapshot, and
+    return how many were taken.
+
+    `at` should be far enough in the past that no transaction still open can record a movement
+    before it, which would be left out of the snapshot.
+    """
+    previous = last_snapshot_at()
+    if previous is not None and previous >= at:
+        raise ValueError(f"The stock was already snapshotted at {previous}")
+    with transaction.atomic():
+        totals = movement_totals(previous, at)
+        levels = latest_snapshots(previous) if previous is not None else {}
+        StockSnapshot.objects.bulk_create(
+            [StockSnapshot(product_unit_id=product_unit_id, taken_at=at,
+                           quantity=levels.get(product_unit_id, 0) + total)
+             for product_unit_id, total in totals.items()],
+            batch_size=BULK_BATCH_SIZE,
+        )
+    return len(totals)
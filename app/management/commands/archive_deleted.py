@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from app.archive import archive_deleted, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Move sale lines, sales and batches soft deleted over --days days ago into their archive tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS,
+                            help="archive rows soft deleted more than this many days ago")
+        parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE,
+                            help="rows moved per transaction")
+
+    def handle(self, *args, days, batch_size, **options):
+        moved = archive_deleted(days, batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            "Archived " + ", ".join(f"{count} {name}" for name, count in moved.items())))
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+
+from app.checkout import checkout, InsufficientStock
+from app.models import Unit, Category, Product, ProductUnit, ProductBatch
+
+SQLITE_MODES = ("default", "tuned")
+
+
+class Command(BaseCommand):
+    help = ("Run concurrent checkouts against a throwaway test database and report throughput and "
+            "failures. On sqlite it runs once with the sqlite defaults and once with SQLITE_TUNED_OPTIONS, "
+            "each in a fresh database file, and compares the two.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--checkouts", type=int, default=50, help="checkouts per thread")
+        parser.add_argument("--mode", action="append", choices=SQLITE_MODES,
+                            help="run only these sqlite modes, may be repeated")
+
+    def seed(self, quantity):
+        unit = Unit.objects.create(name="benchmark")
+        category = Category.objects.create(name="benchmark")
+        product = Product.objects.create(name="benchmark", category=category)
+        product_unit = ProductUnit.objects.create(product=product, unit=unit)
+        ProductBatch.objects.create(product_unit=product_unit, quantity=quantity, cost_price=1, selling_price=2)
+        return product_unit
+
+    def handle(self, *args, threads, checkouts, mode, **options):
+        if connection.vendor != "sqlite":
+            self.report("configured options", self.benchmark(threads, checkouts))
+            return
+        database = connection.settings_dict
+        configured_options, configured_test_name = database["OPTIONS"], database["TEST"]["NAME"]
+        modes = {"default": {}, "tuned": settings.SQLITE_TUNED_OPTIONS}
+        throughputs = {}
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                for name in mode or SQLITE_MODES:
+                    # a file rather than the in-memory test database, or neither mode touches a journal;
+                    # threads share this settings dict, so they connect with the same options
+                    database["OPTIONS"] = dict(modes[name])
+                    database["TEST"]["NAME"] = os.path.join(directory, f"{name}.sqlite3")
+                    outcomes, elapsed = self.benchmark(threads, checkouts)
+                    throughputs[name] = outcomes["sold"] / elapsed
+                    self.report(f"{name} {modes[name] or 'sqlite defaults'}", (outcomes, elapsed))
+        finally:
+            database["OPTIONS"], database["TEST"]["NAME"] = configured_options, configured_test_name
+        if throughputs.get("default") and "tuned" in throughputs:
+            self.stdout.write(f"tuned sells {throughputs['tuned'] / throughputs['default']:.1f}x as fast "
+                              f"as default")
+
+    def benchmark(self, threads, checkouts):
+        # created and destroyed the way the test runner does it, so nothing is left behind
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            return self.run_checkouts(self.seed(threads * checkouts), threads, checkouts)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def run_checkouts(self, product_unit, threads, checkouts):
+        barrier = threading.Barrier(threads)
+        outcomes = Counter()
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(checkouts):
+                    try:
+                        checkout([{"product_unit": product_unit, "quantity": 1}])
+                        outcome = "sold"
+                    except InsufficientStock:
+                        outcome = "out of stock"
+                    except Exception as e:
+                        outcome = type(e).__name__
+                    with lock:
+                        outcomes[outcome] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return outcomes, time.perf_counter() - started
+
+    def report(self, label, result):
+        outcomes, elapsed = result
+        self.stdout.write(label)
+        self.stdout.write(f"  {sum(outcomes.values())} checkouts in {elapsed:.2f}s, "
+                          f"{outcomes['sold'] / elapsed:.0f} sales/s")
+        for outcome, count in sorted(outcomes.items()):
+            self.stdout.write(f"  {outcome}: {count}")
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.export import for_each_day
+from app.reorder import compute_reorders, VELOCITY_WINDOW_DAYS, LEAD_TIME_DAYS, TARGET_COVER_DAYS
+from app.rollups import rebuild_day
+
+
+class Command(BaseCommand):
+    help = ("Recompute the reorder suggestions from sales velocity and stock on hand. Velocity is read off "
+            "the daily sales rollups, so sales older than the rollups need --rebuild-rollups or rebuild_rollups "
+            "first")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--window", type=int, default=VELOCITY_WINDOW_DAYS,
+                            help="days of sales the velocity is averaged over")
+        parser.add_argument("--lead-time", type=int, default=LEAD_TIME_DAYS,
+                            help="suggest a reorder when stock covers this many days or fewer")
+        parser.add_argument("--cover", type=int, default=TARGET_COVER_DAYS,
+                            help="days of sales a reorder should cover")
+        parser.add_argument("--rebuild-rollups", action="store_true",
+                            help="rebuild the sales rollups of the days in the window first")
+
+    def handle(self, *args, window, lead_time, cover, rebuild_rollups, **options):
+        if rebuild_rollups:
+            today = timezone.localdate()
+            for_each_day(today - timedelta(days=window), today - timedelta(days=1), rebuild_day)
+        suggestions = compute_reorders(window, lead_time, cover)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(suggestions)} reorder suggestions"))
@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from app.export import DATASETS, FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = "Stream sales, sale lines or product batches as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", choices=DATASETS.keys())
+        parser.add_argument("--format", choices=FORMATS.keys(), default="ndjson", dest="file_format")
+        parser.add_argument("--start", type=date.fromisoformat, help="first day to export (YYYY-MM-DD)")
+        parser.add_argument("--end", type=date.fromisoformat, help="last day to export (YYYY-MM-DD)")
+        parser.add_argument("--output", help="file to write to, defaults to stdout")
+
+    def handle(self, *args, dataset, file_format, start, end, output, **options):
+        chunks = export_lines(dataset, file_format, start, end)
+        if not output:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+        with open(output, "w", newline="") as stream:
+            stream.writelines(chunks)
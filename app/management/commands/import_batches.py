@@ -0,0 +1,27 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app.intake import IntakeError, clean_rows, receive_batches
+
+
+class Command(BaseCommand):
+    help = ("Receive product batches from a CSV file with product_unit, quantity, cost_price and "
+            "selling_price columns, all in one transaction")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, path, chunk_size, **options):
+        received = 0
+        with open(path, newline="") as file, transaction.atomic():
+            rows = csv.DictReader(file)
+            while chunk := [row for _, row in zip(range(chunk_size), rows)]:
+                try:
+                    batches = clean_rows(chunk, first_row=received + 1)
+                except IntakeError as e:
+                    raise CommandError(str(e))
+                received += len(receive_batches(batches))
+        self.stdout.write(self.style.SUCCESS(f"Received {received} batches"))
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.idempotency import prune_keys, PRUNE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Delete the idempotency keys of sales older than IDEMPOTENCY_KEY_TTL_HOURS"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=PRUNE_BATCH_SIZE)
+
+    def handle(self, *args, batch_size, **options):
+        deleted = prune_keys(batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} idempotency keys older than {settings.IDEMPOTENCY_KEY_TTL_HOURS} hours"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app.intake import purge_fingerprints, PURGE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Delete the expired fingerprints of the duplicate batch check"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=PURGE_BATCH_SIZE)
+
+    def handle(self, *args, batch_size, **options):
+        deleted = purge_fingerprints(batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired batch fingerprints"))
@@ -0,0 +1,29 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.export import for_each_day
+from app.models import ProductSale
+from app.rollups import rebuild_day
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily and hourly sales rollups of a range of days from the sale lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=date.fromisoformat,
+                            help="first day to rebuild (YYYY-MM-DD), defaults to the day of the first sale")
+        parser.add_argument("--end", type=date.fromisoformat,
+                            help="last day to rebuild (YYYY-MM-DD), defaults to today")
+
+    def handle(self, *args, start, end, **options):
+        if start is None:
+            first_sale = ProductSale.objects.order_by("created_at").values_list("created_at", flat=True).first()
+            if first_sale is None:
+                self.stdout.write("No sales to roll up")
+                return
+            start = timezone.localtime(first_sale).date()
+        end = end or timezone.localdate()
+        for_each_day(start, end, rebuild_day)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt sales rollups from {start} to {end}"))
@@ -0,0 +1,35 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from app.export import day_start, for_each_day
+from app.ledger import last_snapshot_at, take_snapshot
+from app.models import StockMovement
+
+
+class Command(BaseCommand):
+    help = ("Snapshot the stock at the end of each day since the last snapshot, from the stock ledger. "
+            "Run daily; stock at any time is then a snapshot plus at most a day of movements.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--end", type=date.fromisoformat,
+                            help="last day to snapshot (YYYY-MM-DD), defaults to yesterday")
+
+    def handle(self, *args, end, **options):
+        today = timezone.localdate()
+        end = end or today - timedelta(days=1)
+        if end >= today:
+            raise CommandError("Only days that are over can be snapshotted")
+        previous = last_snapshot_at()
+        if previous is None:
+            first_movement = StockMovement.objects.order_by("created_at").values_list("created_at", flat=True).first()
+            if first_movement is None:
+                self.stdout.write("No stock movements to snapshot")
+                return
+            start = timezone.localtime(first_movement).date()
+        else:
+            # snapshots are taken at the end of a day, that is the start of the next one
+            start = timezone.localtime(previous).date()
+        taken = sum(for_each_day(start, end, lambda day: take_snapshot(day_start(day + timedelta(days=1)))))
+        self.stdout.write(self.style.SUCCESS(f"Took {taken} stock snapshots up to the end of {end}"))
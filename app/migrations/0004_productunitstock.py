@@ -0,0 +1,57 @@
+# Generated by Django 5.1.2 on 2026-10-17 07:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_stock(apps, schema_editor):
+    ProductUnit = apps.get_model("app", "ProductUnit")
+    ProductBatch = apps.get_model("app", "ProductBatch")
+    ProductUnitStock = apps.get_model("app", "ProductUnitStock")
+    snapshots = {
+        pk: ProductUnitStock(product_unit_id=pk)
+        for pk in ProductUnit.objects.filter(deleted_at__isnull=True).values_list("id", flat=True)
+    }
+    batches = (ProductBatch.objects.filter(deleted_at__isnull=True, quantity__gt=0,
+                                           product_unit_id__in=snapshots.keys())
+               .order_by("product_unit_id", "created_at", "id"))
+    for batch in batches:
+        stock = snapshots[batch.product_unit_id]
+        if stock.current_batch_id is None:
+            stock.current_batch_id = batch.id
+            stock.cost_price = batch.cost_price
+            stock.selling_price = batch.selling_price
+            stock.quantity_left = batch.quantity
+        stock.total_quantity += batch.quantity
+    ProductUnitStock.objects.bulk_create(snapshots.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_remove_productunit_archived'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductUnitStock',
+            fields=[
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('restored_at', models.DateTimeField(blank=True, null=True)),
+                ('transaction_id', models.UUIDField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product_unit', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock', serialize=False, to='app.productunit')),
+                ('cost_price', models.DecimalField(decimal_places=2, max_digits=10, null=True)),
+                ('selling_price', models.DecimalField(decimal_places=2, max_digits=10, null=True)),
+                ('quantity_left', models.PositiveIntegerField(default=0)),
+                ('total_quantity', models.PositiveIntegerField(default=0)),
+                ('current_batch', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.productbatch')),
+            ],
+            options={
+                'verbose_name_plural': 'Product Unit Stock',
+                'indexes': [models.Index(fields=['total_quantity'], name='productunitstock_total_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_stock, migrations.RunPython.noop),
+    ]
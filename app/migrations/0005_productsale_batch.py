@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-17 07:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_productunitstock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productsale',
+            name='batch',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='app.productbatch'),
+        ),
+    ]
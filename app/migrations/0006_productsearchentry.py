@@ -0,0 +1,97 @@
+# Generated by Django 5.1.2 on 2026-10-17 07:10
+
+import django.db.models.deletion
+from collections import defaultdict
+
+from django.db import migrations, models
+
+SQLITE_INDEX = [
+    """CREATE VIRTUAL TABLE app_productsearch_fts USING fts5(
+        name, category, units,
+        content='app_productsearchentry', content_rowid='product_id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER app_productsearch_ai AFTER INSERT ON app_productsearchentry BEGIN
+        INSERT INTO app_productsearch_fts(rowid, name, category, units)
+        VALUES (new.product_id, new.name, new.category, new.units);
+    END""",
+    """CREATE TRIGGER app_productsearch_ad AFTER DELETE ON app_productsearchentry BEGIN
+        INSERT INTO app_productsearch_fts(app_productsearch_fts, rowid, name, category, units)
+        VALUES ('delete', old.product_id, old.name, old.category, old.units);
+    END""",
+    """CREATE TRIGGER app_productsearch_au AFTER UPDATE ON app_productsearchentry BEGIN
+        INSERT INTO app_productsearch_fts(app_productsearch_fts, rowid, name, category, units)
+        VALUES ('delete', old.product_id, old.name, old.category, old.units);
+        INSERT INTO app_productsearch_fts(rowid, name, category, units)
+        VALUES (new.product_id, new.name, new.category, new.units);
+    END""",
+]
+
+POSTGRESQL_INDEX = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX app_productsearch_name_trgm ON app_productsearchentry USING gin (name gin_trgm_ops)",
+    "CREATE INDEX app_productsearch_category_trgm ON app_productsearchentry USING gin (category gin_trgm_ops)",
+    "CREATE INDEX app_productsearch_units_trgm ON app_productsearchentry USING gin (units gin_trgm_ops)",
+]
+
+DROP_INDEX = {
+    "sqlite": ["DROP TABLE IF EXISTS app_productsearch_fts"],
+    "postgresql": [
+        "DROP INDEX IF EXISTS app_productsearch_name_trgm",
+        "DROP INDEX IF EXISTS app_productsearch_category_trgm",
+        "DROP INDEX IF EXISTS app_productsearch_units_trgm",
+    ],
+}
+
+
+def create_search_index(apps, schema_editor):
+    statements = {"sqlite": SQLITE_INDEX, "postgresql": POSTGRESQL_INDEX}
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+    Product = apps.get_model("app", "Product")
+    ProductUnit = apps.get_model("app", "ProductUnit")
+    ProductSearchEntry = apps.get_model("app", "ProductSearchEntry")
+    units = defaultdict(list)
+    product_units = (ProductUnit.objects.filter(deleted_at__isnull=True, unit__isnull=False)
+                     .order_by("unit__name").values_list("product_id", "unit__name"))
+    for product_id, unit in product_units:
+        units[product_id].append(unit)
+    ProductSearchEntry.objects.bulk_create(
+        (ProductSearchEntry(product_id=pk, name=name, category=category or "", units=" ".join(units[pk]))
+         for pk, name, category in Product.objects.filter(deleted_at__isnull=True)
+         .values_list("id", "name", "category__name").iterator()),
+        batch_size=1000,
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    for statement in DROP_INDEX.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_productsale_batch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchEntry',
+            fields=[
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('restored_at', models.DateTimeField(blank=True, null=True)),
+                ('transaction_id', models.UUIDField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_entry', serialize=False, to='app.product')),
+                ('name', models.CharField(max_length=200)),
+                ('category', models.CharField(blank=True, default='', max_length=150)),
+                ('units', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'verbose_name_plural': 'Product Search Entries',
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.2 on 2026-10-17 07:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_productsearchentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('units_sold', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('discounted_revenue', models.DecimalField(decimal_places=5, default=0, max_digits=17)),
+                ('profit', models.DecimalField(decimal_places=5, default=0, max_digits=17)),
+                ('period', models.DateField()),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='app.category')),
+                ('product_unit', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='app.productunit')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'category'], name='dailysalesrollup_category_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'product_unit'), name='dailysalesrollup_period_unit_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('units_sold', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('discounted_revenue', models.DecimalField(decimal_places=5, default=0, max_digits=17)),
+                ('profit', models.DecimalField(decimal_places=5, default=0, max_digits=17)),
+                ('period', models.DateTimeField()),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='app.category')),
+                ('product_unit', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='app.productunit')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'category'], name='hourlysalesrollup_category_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'product_unit'), name='hourlysalesrollup_period_unit_uniq')],
+            },
+        ),
+    ]
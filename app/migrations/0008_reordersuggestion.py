@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-17 07:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_salesrollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReorderSuggestion',
+            fields=[
+                ('product_unit', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='app.productunit')),
+                ('status', models.CharField(choices=[('out_of_stock', 'Out of stock'), ('low', 'Low')], max_length=20)),
+                ('on_hand', models.PositiveIntegerField(default=0)),
+                ('velocity', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('days_of_cover', models.DecimalField(decimal_places=1, max_digits=12)),
+                ('reorder_quantity', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['days_of_cover'], name='reordersuggestion_cover_idx')],
+            },
+        ),
+    ]
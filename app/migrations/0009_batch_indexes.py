@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-17 07:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_reordersuggestion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productbatch',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True), ('quantity__gt', 0)), fields=['product_unit', 'created_at', 'id'], name='productbatch_fifo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productbatch',
+            index=models.Index(fields=['product_unit', 'created_at'], name='productbatch_unit_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productbatch',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='productbatch_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsale',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='productsale_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saletransaction',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='saletransaction_deleted_idx'),
+        ),
+    ]
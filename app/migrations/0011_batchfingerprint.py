@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-17 08:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchFingerprint',
+            fields=[
+                ('fingerprint', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='productbatch',
+            name='productbatch_unit_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='batchfingerprint',
+            index=models.Index(fields=['expires_at'], name='batchfingerprint_expires_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.2 on 2026-10-17 08:22
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def open_ledger(apps, schema_editor):
+    # the stock on hand before the ledger existed, as one adjustment per batch
+    ProductBatch = apps.get_model("app", "ProductBatch")
+    StockMovement = apps.get_model("app", "StockMovement")
+    batches = (ProductBatch.objects.filter(deleted_at__isnull=True, quantity__gt=0)
+               .values_list("id", "product_unit_id", "quantity").iterator(chunk_size=1000))
+    StockMovement.objects.bulk_create(
+        (StockMovement(batch_id=batch_id, product_unit_id=product_unit_id, kind="adjustment", quantity=quantity)
+         for batch_id, product_unit_id, quantity in batches),
+        batch_size=1000,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_batchfingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('sale', 'Sale'), ('adjustment', 'Adjustment'), ('return', 'Return')], max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('batch', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='app.productbatch')),
+                ('product_unit', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='app.productunit')),
+                ('sale', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='app.saletransaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product_unit', 'created_at', 'id'], name='stockmovement_unit_created_idx'), models.Index(fields=['created_at'], name='stockmovement_created_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('quantity', models.IntegerField()),
+                ('product_unit', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='app.productunit')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['taken_at'], name='stocksnapshot_taken_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product_unit', 'taken_at'), name='stocksnapshot_unit_taken_uniq')],
+            },
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.1.2 on 2026-10-17 08:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_stockledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedProductBatch',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('deleted_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product_unit_id', models.BigIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('cost_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('selling_price', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedProductSale',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('deleted_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product_unit_id', models.BigIntegerField()),
+                ('sale_id', models.BigIntegerField(null=True)),
+                ('batch_id', models.BigIntegerField(null=True)),
+                ('cost_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('selling_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quantity', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedSaleTransaction',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('deleted_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('percentage_discount', models.DecimalField(decimal_places=1, max_digits=3)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productbatch',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['created_at'], name='productbatch_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsale',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['created_at'], name='productsale_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saletransaction',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['created_at'], name='saletransaction_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedproductsale',
+            index=models.Index(fields=['sale_id'], name='archivedproductsale_sale_idx'),
+        ),
+    ]
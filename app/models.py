@@ -1,7 +1,11 @@
 from decimal import Decimal
 
-from django.db import models
-from django.db.models import F
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django_softdelete.managers import SoftDeleteManager, SoftDeleteQuerySet
 
 from core.models import BaseModel
 
@@ -64,6 +68,50 @@ class ProductBatch(BaseModel):
 
     class Meta:
         verbose_name_plural = "Product Batches"
+        indexes = [
+            # FIFO lookup of the in-stock batches of product units (checkout, stock snapshots)
+            models.Index(fields=["product_unit", "created_at", "id"], name="productbatch_fifo_idx",
+                         condition=Q(quantity__gt=0, deleted_at__isnull=True)),
+            models.Index(fields=["deleted_at"], name="productbatch_deleted_idx",
+                         condition=Q(deleted_at__isnull=False)),
+            # live rows by date (exports), soft deleted rows are left out until they are archived
+            models.Index(fields=["created_at"], name="productbatch_created_idx",
+                         condition=Q(deleted_at__isnull=True)),
+        ]
+
+
+class ProductUnitStock(BaseModel):
+    """Precomputed stock snapshot of a product unit, kept in sync by app.stock.refresh_stock"""
+    product_unit = models.OneToOneField("ProductUnit", on_delete=models.CASCADE, primary_key=True,
+                                        related_name="stock")
+    current_batch = models.ForeignKey("ProductBatch", on_delete=models.SET_NULL, null=True, related_name="+")
+    cost_price = models.DecimalField(null=True, max_digits=10, decimal_places=2)
+    selling_price = models.DecimalField(null=True, max_digits=10, decimal_places=2)
+    quantity_left = models.PositiveIntegerField(default=0)
+    total_quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Product Unit Stock"
+        indexes = [
+            models.Index(fields=["total_quantity"], name="productunitstock_total_idx"),
+        ]
+
+    @property
+    def out_of_stock(self):
+        return self.current_batch_id is None
+
+
+class ProductSearchEntry(BaseModel):
+    """Denormalized search document of a product, indexed by the backend specific tables in app.search"""
+    product = models.OneToOneField("Product", on_delete=models.CASCADE, primary_key=True,
+                                   related_name="search_entry")
+    name = models.CharField(max_length=200)
+    category = models.CharField(max_length=150, blank=True, default="")
+    units = models.TextField(blank=True, default="")
+
+    class Meta:
+        verbose_name_plural = "Product Search Entries"
+
 
 class ProductSale(BaseModel):
     product_unit = models.ForeignKey("ProductUnit", on_delete=models.DO_NOTHING)
@@ -71,21 +119,266 @@ class ProductSale(BaseModel):
     selling_price = models.DecimalField(default=0, max_digits=10, decimal_places=2)
     quantity = models.PositiveIntegerField(default=0)
     sale = models.ForeignKey("SaleTransaction", on_delete=models.CASCADE, null=True, default=None)
+    batch = models.ForeignKey("ProductBatch", on_delete=models.DO_NOTHING, null=True, default=None)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["deleted_at"], name="productsale_deleted_idx",
+                         condition=Q(deleted_at__isnull=False)),
+            # live rows by date (exports, rollup rebuilds)
+            models.Index(fields=["created_at"], name="productsale_created_idx",
+                         condition=Q(deleted_at__isnull=True)),
+        ]
+
+    def save(self, *args, **kwargs):
+        # the signals allocating and deducting the stock of a new line must commit with it
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    @property
+    def total_selling_price(self):
+        return self.selling_price * self.quantity
+
+    @property
+    def total_cost_price(self):
+        return self.cost_price * self.quantity
+
+    @property
+    def profit(self):
+        return self.total_selling_price - self.total_cost_price
+
+
+def line_total(price):
+    return Sum(F(price) * F("quantity"), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+
+
+class SaleTransactionQuerySet(SoftDeleteQuerySet):
+    def with_totals(self):
+        """Annotate each sale with the selling and cost totals of its lines, summed in SQL."""
+        lines = ProductSale.objects.filter(sale=OuterRef("pk")).order_by().values("sale")
+        totals = {}
+        for name, price in (("selling_total", "selling_price"), ("cost_total", "cost_price")):
+            totals[name] = Coalesce(
+                Subquery(lines.annotate(total=line_total(price)).values("total")),
+                Value(Decimal(0)),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            )
+        return self.annotate(**totals)
+
+
+class SaleTransactionManager(SoftDeleteManager):
+    def get_queryset(self):
+        return SaleTransactionQuerySet(self.model, using=self._db).filter(deleted_at__isnull=True)
+
+    def with_totals(self):
+        return self.get_queryset().with_totals()
 
 
 class SaleTransaction(BaseModel):
     percentage_discount = models.DecimalField(default=0, max_digits=3, decimal_places=1)
+
+    objects = SaleTransactionManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["deleted_at"], name="saletransaction_deleted_idx",
+                         condition=Q(deleted_at__isnull=False)),
+            models.Index(fields=["created_at"], name="saletransaction_created_idx",
+                         condition=Q(deleted_at__isnull=True)),
+        ]
+
+    def load_totals(self):
+        # sales fetched through with_totals() already carry them
+        if not hasattr(self, "selling_total"):
+            totals = self.productsale_set.aggregate(selling_total=line_total("selling_price"),
+                                                    cost_total=line_total("cost_price"))
+            self.selling_total = totals["selling_total"] or Decimal(0)
+            self.cost_total = totals["cost_total"] or Decimal(0)
+
     def actual_selling_price(self):
-        return sum(sale.selling_price for sale in self.productsale_set.all())
+        self.load_totals()
+        return self.selling_total
 
     def actual_profit(self):
         return self.actual_selling_price() - self.total_cost_price()
 
     def total_cost_price(self):
-        return sum(sale.cost_price for sale in self.productsale_set.all())
+        self.load_totals()
+        return self.cost_total
 
     def final_selling_price(self):
         return self.actual_selling_price() - (self.actual_selling_price() * Decimal(self.percentage_discount/100))
 
     def final_profit(self):
-        return self.final_selling_price() - self.total_cost_price()
\ No newline at end of file
+        return self.final_selling_price() - self.total_cost_price()
+
+
+class Archive(models.Model):
+    """Soft deleted row moved out of its hot table by app.archive, under its original id"""
+    id = models.BigIntegerField(primary_key=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    deleted_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        abstract = True
+
+
+class ArchivedSaleTransaction(Archive):
+    percentage_discount = models.DecimalField(max_digits=3, decimal_places=1)
+
+
+class ArchivedProductBatch(Archive):
+    # plain ids, the rows they point at may be archived too
+    product_unit_id = models.BigIntegerField()
+    quantity = models.PositiveIntegerField()
+    cost_price = models.DecimalField(max_digits=10, decimal_places=2)
+    selling_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+
+class ArchivedProductSale(Archive):
+    product_unit_id = models.BigIntegerField()
+    sale_id = models.BigIntegerField(null=True)
+    batch_id = models.BigIntegerField(null=True)
+    cost_price = models.DecimalField(max_digits=10, decimal_places=2)
+    selling_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["sale_id"], name="archivedproductsale_sale_idx"),
+        ]
+
+
+class StockMovement(models.Model):
+    """Append-only record of a change to the stock of a product unit, written by app.ledger"""
+    RECEIPT = "receipt"
+    SALE = "sale"
+    ADJUSTMENT = "adjustment"
+    RETURN = "return"
+    KINDS = ((RECEIPT, "Receipt"), (SALE, "Sale"), (ADJUSTMENT, "Adjustment"), (RETURN, "Return"))
+
+    product_unit = models.ForeignKey("ProductUnit", on_delete=models.DO_NOTHING, related_name="+")
+    # the ledger outlives the batches and sales it refers to, they are not constrained
+    batch = models.ForeignKey("ProductBatch", on_delete=models.DO_NOTHING, null=True, related_name="+",
+                              db_constraint=False)
+    sale = models.ForeignKey("SaleTransaction", on_delete=models.DO_NOTHING, null=True, related_name="+",
+                             db_constraint=False)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    # positive into stock, negative out of it
+    quantity = models.IntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["product_unit", "created_at", "id"], name="stockmovement_unit_created_idx"),
+            models.Index(fields=["created_at"], name="stockmovement_created_idx"),
+        ]
+
+
+class StockSnapshot(models.Model):
+    """Stock of a product unit at the end of a day it moved, taken by app.ledger.take_snapshot"""
+    product_unit = models.ForeignKey("ProductUnit", on_delete=models.DO_NOTHING, related_name="+")
+    taken_at = models.DateTimeField()
+    quantity = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product_unit", "taken_at"], name="stocksnapshot_unit_taken_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["taken_at"], name="stocksnapshot_taken_idx"),
+        ]
+
+
+class BatchFingerprint(models.Model):
+    """Hash of a batch received recently, a repeat of it is rejected as a duplicate until it expires"""
+    fingerprint = models.CharField(max_length=64, primary_key=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["expires_at"], name="batchfingerprint_expires_idx"),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """Outcome of a POST /sales made with an Idempotency-Key header, replayed to retries of it"""
+    key = models.CharField(max_length=255, primary_key=True)
+    # sha256 of the request body, a key reused for a different sale is rejected
+    request_hash = models.CharField(max_length=64)
+    # linked inside the checkout transaction, so a sale is never made twice for one key
+    sale = models.OneToOneField("SaleTransaction", on_delete=models.SET_NULL, null=True, related_name="+")
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    # start of the lease of the request serving the key, renewed when a retry takes it over
+    claimed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="idempotencykey_created_idx"),
+        ]
+
+
+class ReorderSuggestion(models.Model):
+    """Product unit running low against its sales velocity, written by app.reorder.compute_reorders"""
+    OUT_OF_STOCK = "out_of_stock"
+    LOW = "low"
+    STATUSES = ((OUT_OF_STOCK, "Out of stock"), (LOW, "Low"))
+
+    product_unit = models.OneToOneField("ProductUnit", on_delete=models.CASCADE, primary_key=True,
+                                        related_name="+")
+    status = models.CharField(max_length=20, choices=STATUSES)
+    on_hand = models.PositiveIntegerField(default=0)
+    # moving average of units sold per day
+    velocity = models.DecimalField(max_digits=12, decimal_places=3)
+    days_of_cover = models.DecimalField(max_digits=12, decimal_places=1)
+    reorder_quantity = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["days_of_cover"], name="reordersuggestion_cover_idx"),
+        ]
+
+
+class SalesRollup(models.Model):
+    """Sales totals of a product unit over one period, maintained by app.rollups"""
+    # reverse relations are hidden so that soft deleting a product unit leaves its history alone
+    product_unit = models.ForeignKey("ProductUnit", on_delete=models.DO_NOTHING, related_name="+")
+    category = models.ForeignKey("Category", on_delete=models.DO_NOTHING, null=True, related_name="+")
+    units_sold = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+    cost = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+    # discounts have one decimal place, which keeps discounted amounts exact at five
+    discounted_revenue = models.DecimalField(default=0, max_digits=17, decimal_places=5)
+    profit = models.DecimalField(default=0, max_digits=17, decimal_places=5)
+
+    class Meta:
+        abstract = True
+
+
+class DailySalesRollup(SalesRollup):
+    period = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["period", "product_unit"], name="dailysalesrollup_period_unit_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["period", "category"], name="dailysalesrollup_category_idx"),
+        ]
+
+
+class HourlySalesRollup(SalesRollup):
+    period = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["period", "product_unit"], name="hourlysalesrollup_period_unit_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["period", "category"], name="hourlysalesrollup_category_idx"),
+        ]
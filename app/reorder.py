@@ -0,0 +1,67 @@
+import math
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from app.models import DailySalesRollup, ProductUnitStock, ReorderSuggestion
+from core.cache import bump_version
+
+VELOCITY_WINDOW_DAYS = 28
+LEAD_TIME_DAYS = 7
+TARGET_COVER_DAYS = 21
+WRITE_BATCH_SIZE = 5000
+
+
+def sales_velocity(window_days=VELOCITY_WINDOW_DAYS, today=None):
+    """Return {product unit id: units sold per day} over the last `window_days` full days."""
+    today = today or timezone.localdate()
+    sold = (DailySalesRollup.objects.filter(period__gte=today - timedelta(days=window_days), period__lt=today)
+            .values_list("product_unit").annotate(units=Sum("units_sold")).order_by())
+    return {product_unit_id: Decimal(units) / window_days for product_unit_id, units in sold}
+
+
+def compute_reorders(window_days=VELOCITY_WINDOW_DAYS, lead_time_days=LEAD_TIME_DAYS,
+                     target_cover_days=TARGET_COVER_DAYS):
+    """
+    Replace the reorder suggestions with the product units that are out of stock or will run out
+    within the lead time at their current sales velocity.
+
+    Velocity is read off the daily sales rollups and stock off the stock snapshots, one grouped
+    query each, so the cost is two reads and a bulk write whatever the number of product units.
+    Sales recorded before the rollups existed only count once their days were rebuilt, see
+    rebuild_rollups. Product units with nothing to reorder, such as one that was never sold, are
+    left out.
+    """
+    now = timezone.now()
+    velocities = sales_velocity(window_days, timezone.localdate(now))
+    suggestions = []
+    stock = (ProductUnitStock.objects.filter(product_unit__deleted_at__isnull=True)
+             .values_list("product_unit_id", "total_quantity").iterator(chunk_size=WRITE_BATCH_SIZE))
+    for product_unit_id, on_hand in stock:
+        velocity = velocities.get(product_unit_id, Decimal(0))
+        if on_hand:
+            if not velocity or on_hand / velocity > lead_time_days:
+                continue
+            days_of_cover = on_hand / velocity
+        else:
+            days_of_cover = Decimal(0)
+        reorder_quantity = math.ceil(velocity * target_cover_days) - on_hand
+        if reorder_quantity <= 0:
+            continue
+        suggestions.append(ReorderSuggestion(
+            product_unit_id=product_unit_id,
+            status=ReorderSuggestion.LOW if on_hand else ReorderSuggestion.OUT_OF_STOCK,
+            on_hand=on_hand,
+            velocity=velocity.quantize(Decimal("0.001")),
+            days_of_cover=days_of_cover.quantize(Decimal("0.1")),
+            reorder_quantity=reorder_quantity,
+            computed_at=now,
+        ))
+    with transaction.atomic():
+        ReorderSuggestion.objects.all().delete()
+        ReorderSuggestion.objects.bulk_create(suggestions, batch_size=WRITE_BATCH_SIZE)
+        bump_version("ReorderSuggestion")
+    return suggestions
@@ -0,0 +1,159 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate, TruncHour, TruncMonth
+from django.utils import timezone
+
+from app.export import day_start
+from app.models import DailySalesRollup, HourlySalesRollup, ProductSale, ProductUnit, line_total
+
+TOTALS = ("units_sold", "revenue", "cost", "discounted_revenue", "profit")
+UPSERT_BATCH_SIZE = 100
+CENT = Decimal("0.01")
+
+
+def day_period(moment):
+    return timezone.localtime(moment).date()
+
+
+def hour_period(moment):
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+# rollup model, how a sale line timestamp maps to its period in python and in SQL
+ROLLUPS = (
+    (DailySalesRollup, day_period, TruncDate),
+    (HourlySalesRollup, hour_period, TruncHour),
+)
+
+
+def discounted(amount, percentage_discount):
+    return amount * (100 - Decimal(percentage_discount)) / 100
+
+
+def add_totals(totals, units_sold, revenue, cost, percentage_discount):
+    revenue = Decimal(revenue).quantize(CENT)
+    cost = Decimal(cost).quantize(CENT)
+    discounted_revenue = discounted(revenue, percentage_discount)
+    for name, value in zip(TOTALS, (units_sold, revenue, cost, discounted_revenue, discounted_revenue - cost)):
+        totals[name] += value
+
+
+def upsert_rollups(model, rollups):
+    """Add `rollups` ({(period, product unit id): (category id, totals)}) onto the rows of `model`."""
+    rows = [model(period=period, product_unit_id=product_unit_id, category_id=category_id, **totals)
+            for (period, product_unit_id), (category_id, totals) in rollups.items()]
+    if not connection.features.supports_update_conflicts_with_target:
+        for row in rows:
+            _, created = model.objects.get_or_create(period=row.period, product_unit_id=row.product_unit_id,
+                                                     defaults={field: getattr(row, field) for field in
+                                                               ("category_id", *TOTALS)})
+            if not created:
+                model.objects.filter(period=row.period, product_unit_id=row.product_unit_id).update(
+                    category_id=row.category_id, **{field: F(field) + getattr(row, field) for field in TOTALS})
+        return
+    # bulk_create can only overwrite on conflict, the totals have to be added in SQL
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in ("period", "product_unit", "category", *TOTALS)]
+    columns = [quote(field.column) for field in fields]
+    updates = ", ".join([f"{columns[2]} = excluded.{columns[2]}"] +
+                        [f"{column} = {table}.{column} + excluded.{column}" for column in columns[3:]])
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            values = ", ".join(["(%s)" % ", ".join(["%s"] * len(fields))] * len(batch))
+            params = [field.get_db_prep_save(getattr(row, field.attname), connection)
+                      for row in batch for field in fields]
+            cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values} "
+                           f"ON CONFLICT ({columns[0]}, {columns[1]}) DO UPDATE SET {updates}", params)
+
+
+def subtract_rollups(model, rollups):
+    """Take `rollups`, shaped as for upsert_rollups, off the rows of `model` they were added onto."""
+    for (period, product_unit_id), (_, totals) in rollups.items():
+        rows = model.objects.filter(period=period, product_unit_id=product_unit_id)
+        rows.update(**{field: F(field) - totals[field] for field in TOTALS})
+        # a period left with no sales has no row, as rebuild_day leaves it
+        rows.filter(units_sold=0).delete()
+
+
+def record_sales(lines, subtract=False):
+    """
+    Add saved sale lines to the daily and hourly rollups, or take them off with `subtract`.
+
+    Runs in the transaction that records the lines, so the rollups commit or roll back with them.
+    """
+    if not lines:
+        return
+    categories = dict(ProductUnit.global_objects.filter(pk__in={line.product_unit_id for line in lines})
+                      .values_list("id", "product__category_id"))
+    for model, period, _ in ROLLUPS:
+        rollups = {}
+        for line in lines:
+            key = (period(line.created_at), line.product_unit_id)
+            _, totals = rollups.setdefault(key, (categories[line.product_unit_id], defaultdict(int)))
+            percentage_discount = line.sale.percentage_discount if line.sale_id else 0
+            add_totals(totals, line.quantity, line.total_selling_price, line.total_cost_price, percentage_discount)
+        # units sold cannot go negative, not even in the row an upsert proposes
+        (subtract_rollups if subtract else upsert_rollups)(model, rollups)
+
+
+def period_filter(model, start, end):
+    """Lookups selecting the rows of `model` that fall on the days from `start` to `end`."""
+    if model is HourlySalesRollup:
+        return {"period__gte": day_start(start), "period__lt": day_start(end + timedelta(days=1))}
+    return {"period__gte": start, "period__lte": end}
+
+
+def rebuild_day(day):
+    """Recompute the rollups of `day` from its sale lines."""
+    lines = ProductSale.objects.filter(created_at__gte=day_start(day),
+                                       created_at__lt=day_start(day + timedelta(days=1)))
+    with transaction.atomic():
+        for model, _, truncate in ROLLUPS:
+            model.objects.filter(**period_filter(model, day, day)).delete()
+            # grouped by discount too, so the discounted totals are worked out exactly in python
+            groups = (lines.annotate(period=truncate("created_at"))
+                      .values("period", "product_unit", "product_unit__product__category",
+                              "sale__percentage_discount")
+                      .annotate(units_sold=Sum("quantity"), revenue=line_total("selling_price"),
+                                cost=line_total("cost_price"))
+                      .order_by())
+            rollups = {}
+            for group in groups:
+                key = (group["period"], group["product_unit"])
+                _, totals = rollups.setdefault(key, (group["product_unit__product__category"], defaultdict(int)))
+                add_totals(totals, group["units_sold"], group["revenue"], group["cost"],
+                           group["sale__percentage_discount"] or 0)
+            model.objects.bulk_create(
+                [model(period=period, product_unit_id=product_unit_id, category_id=category_id, **totals)
+                 for (period, product_unit_id), (category_id, totals) in rollups.items()],
+                batch_size=UPSERT_BATCH_SIZE,
+            )
+
+
+REPORT_PERIODS = {
+    "hour": (HourlySalesRollup, F("period")),
+    "day": (DailySalesRollup, F("period")),
+    "month": (DailySalesRollup, TruncMonth("period")),
+}
+
+REPORT_GROUPS = {
+    "product_unit": ("product_unit",),
+    "category": ("category", "category__name"),
+}
+
+
+def sales_report(start, end, period="day", group_by=None):
+    """Sum the rollups of the days from `start` to `end` per `period`, and per product unit or category."""
+    model, period_expression = REPORT_PERIODS[period]
+    rows = model.objects.filter(**period_filter(model, start, end))
+    groups = REPORT_GROUPS.get(group_by, ())
+    return (rows.annotate(report_period=period_expression)
+            .values("report_period", *groups)
+            .annotate(**{name: Sum(name) for name in TOTALS})
+            .order_by("report_period", *groups))
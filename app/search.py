@@ -0,0 +1,89 @@
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Case, When, F, Func, Q, Value, FloatField, IntegerField
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Length, Lower
+
+from app.models import Product, ProductUnit, ProductSearchEntry
+
+INDEX_CHUNK_SIZE = 5000
+# sqlite FTS5 trigram index over ProductSearchEntry, created and kept in sync by triggers in the migrations
+FTS_TABLE = "app_productsearch_fts"
+
+
+def index_products(product_ids):
+    """Rebuild the search entries of the given products, dropping those of deleted products."""
+    product_ids = list(set(product_ids))
+    for start in range(0, len(product_ids), INDEX_CHUNK_SIZE):
+        _index_products(set(product_ids[start:start + INDEX_CHUNK_SIZE]))
+
+
+def _index_products(product_ids):
+    entries = {
+        pk: ProductSearchEntry(product_id=pk, name=name, category=category or "")
+        for pk, name, category in Product.objects.filter(pk__in=product_ids).values_list("id", "name",
+                                                                                        "category__name")
+    }
+    units = defaultdict(list)
+    product_units = (ProductUnit.objects.filter(product_id__in=entries, unit__isnull=False)
+                     .order_by("unit__name").values_list("product_id", "unit__name"))
+    for product_id, unit in product_units:
+        units[product_id].append(unit)
+    for pk, entry in entries.items():
+        entry.units = " ".join(units[pk])
+    if product_ids - entries.keys():
+        ProductSearchEntry.global_objects.filter(pk__in=product_ids - entries.keys()).delete()
+    ProductSearchEntry.objects.bulk_create(entries.values(), update_conflicts=True, unique_fields=["product"],
+                                           update_fields=["name", "category", "units"])
+
+
+def escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def matching_entries(term):
+    """
+    Return a filter on Product that keeps the products whose name, category or units contain
+    `term`, read off the backend's trigram index when there is one.
+    """
+    table = ProductSearchEntry._meta.db_table
+    # the trigram tokenizer needs at least 3 characters to match anything
+    if connection.vendor == "sqlite" and len(term) >= 3:
+        return Q(pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                               ['"%s"' % term.replace('"', '""')]))
+    if connection.vendor == "postgresql":
+        # ILIKE, unlike the UPPER() LIKE of icontains, is served by the gin_trgm_ops indexes
+        like = f"%{escape_like(term)}%"
+        return Q(pk__in=RawSQL(f"SELECT product_id FROM {table} "
+                               f"WHERE name ILIKE %s OR category ILIKE %s OR units ILIKE %s", [like, like, like]))
+    return (Q(search_entry__name__icontains=term) | Q(search_entry__category__icontains=term)
+            | Q(search_entry__units__icontains=term))
+
+
+def search_products(queryset, term):
+    """
+    Narrow a Product queryset down to the products whose name, category or units contain `term`,
+    best match first: name prefix, then name, then category, then unit matches, shorter names first.
+
+    Matching and ranking both run in SQL, so the database only sorts the matches and the paginator
+    slices the page it needs off the ranked queryset.
+    """
+    term = term.strip().lower()
+    if not term:
+        return queryset.none()
+
+    def misses(lookup):
+        return Case(When(**{lookup: term}, then=Value(0)), default=Value(1), output_field=IntegerField())
+
+    ranking = [
+        misses("search_entry__name__istartswith"),
+        misses("search_entry__name__icontains"),
+        misses("search_entry__category__icontains"),
+    ]
+    if connection.vendor == "postgresql":
+        # pg_trgm ranks names closest to the term first within each group
+        ranking.append(Func(Value(term), F("search_entry__name"), function="word_similarity",
+                            output_field=FloatField()).desc())
+    return queryset.filter(matching_entries(term)).order_by(
+        *ranking, Length("search_entry__name"), Lower("search_entry__name"), "pk")
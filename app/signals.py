@@ -1,14 +1,114 @@
-from django.db.models import F
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
+from django_softdelete.signals import post_restore, post_soft_delete
 
-from app.models import ProductSale
+from app.checkout import allocate_line, deduct_stock
+from app.ledger import record_movements, receipts, sales, reconcile_batch
+from app.models import ProductSale, ProductBatch, ProductUnit, Product, Category, Unit
+from app.rollups import record_sales
+from app.search import index_products
+from app.stock import refresh_stock
+from core.cache import bump_version
+
+
+@receiver(pre_save, sender=ProductSale)
+def allocate_product_sale(instance, raw, **kwargs):
+    # sales made through app.checkout are bulk created and allocate their own stock; a line saved
+    # on its own is checked before it is written, so a shortage leaves no row behind
+    if instance._state.adding and not raw:
+        instance._extra_lines = allocate_line(instance)
 
 
 @receiver(post_save, sender=ProductSale)
-def update_product_stock(instance, created, **kwargs):
+def update_product_stock(instance, created, raw, **kwargs):
+    if created and not raw:
+        extra_lines = instance.__dict__.pop("_extra_lines", [])
+        for line in extra_lines:
+            line.sale_id = instance.sale_id
+        ProductSale.objects.bulk_create(extra_lines)
+        lines = [instance, *extra_lines]
+        deduct_stock({line.batch_id: line.quantity for line in lines if line.batch_id is not None})
+        record_movements(sales(lines))
+        refresh_stock([instance.product_unit_id])
+        record_sales(lines)
+
+
+# soft deleting a sale soft deletes its lines one by one, and restoring it restores them, so the
+# rollups follow the lines alone; archiving only hard deletes lines that are already soft deleted
+@receiver(post_soft_delete, sender=ProductSale)
+def unrecord_deleted_sale(instance, **kwargs):
+    record_sales([instance], subtract=True)
+
+
+@receiver(post_restore, sender=ProductSale)
+def record_restored_sale(instance, **kwargs):
+    record_sales([instance])
+
+
+@receiver(post_save, sender=ProductBatch)
+def record_batch_movement(instance, created, **kwargs):
+    # batches received through app.intake are bulk created and record their own receipts;
+    # soft deleting and restoring a batch save it too
+    if created:
+        record_movements(receipts([instance]))
+    else:
+        reconcile_batch(instance.pk)
+
+
+@receiver(post_save, sender=ProductBatch)
+@receiver(post_delete, sender=ProductBatch)
+def sync_batch_stock(instance, **kwargs):
+    refresh_stock([instance.product_unit_id])
+
+
+@receiver(post_save, sender=ProductUnit)
+def create_product_unit_stock(instance, created, **kwargs):
     if created:
-        batch = instance.product_unit.current_batch
-        quantity = instance.quantity
-        batch.quantity = F("quantity") - quantity
-        batch.save()
\ No newline at end of file
+        refresh_stock([instance.pk])
+
+
+@receiver(post_restore, sender=ProductUnit)
+def restore_product_unit_stock(instance, **kwargs):
+    refresh_stock([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_restore, sender=Product)
+def index_product(instance, **kwargs):
+    index_products([instance.pk])
+
+
+@receiver(post_save, sender=ProductUnit)
+@receiver(post_delete, sender=ProductUnit)
+@receiver(post_restore, sender=ProductUnit)
+def index_product_unit(instance, **kwargs):
+    index_products([instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(instance, created, **kwargs):
+    if not created:
+        index_products(Product.objects.filter(category=instance).values_list("id", flat=True))
+
+
+@receiver(post_save, sender=Unit)
+def index_unit_products(instance, created, **kwargs):
+    if not created:
+        index_products(ProductUnit.objects.filter(unit=instance).values_list("product_id", flat=True))
+
+
+@receiver(post_save, sender=Unit)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductUnit)
+@receiver(post_delete, sender=Unit)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductUnit)
+@receiver(post_restore, sender=Unit)
+@receiver(post_restore, sender=Category)
+@receiver(post_restore, sender=Product)
+@receiver(post_restore, sender=ProductUnit)
+def invalidate_cached_responses(sender, **kwargs):
+    bump_version(sender.__name__)
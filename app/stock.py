@@ -0,0 +1,29 @@
+from app.models import ProductBatch, ProductUnitStock
+from core.cache import bump_version
+
+
+def refresh_stock(product_unit_ids):
+    """Recompute the stock snapshot of the given product units with one read and one upsert."""
+    product_unit_ids = set(product_unit_ids)
+    if not product_unit_ids:
+        return
+    snapshots = {pk: ProductUnitStock(product_unit_id=pk) for pk in product_unit_ids}
+    batches = (ProductBatch.objects.filter(product_unit_id__in=product_unit_ids, quantity__gt=0)
+               .order_by("product_unit_id", "created_at", "id")
+               .values_list("id", "product_unit_id", "cost_price", "selling_price", "quantity"))
+    for batch_id, product_unit_id, cost_price, selling_price, quantity in batches:
+        stock = snapshots[product_unit_id]
+        if stock.current_batch_id is None:
+            stock.current_batch_id = batch_id
+            stock.cost_price = cost_price
+            stock.selling_price = selling_price
+            stock.quantity_left = quantity
+        stock.total_quantity += quantity
+    ProductUnitStock.objects.bulk_create(
+        snapshots.values(),
+        update_conflicts=True,
+        unique_fields=["product_unit"],
+        update_fields=["current_batch", "cost_price", "selling_price", "quantity_left", "total_quantity",
+                       "updated_at"],
+    )
+    bump_version("ProductUnitStock")
@@ -1,3 +1,353 @@
-from django.test import TestCase
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum, QuerySet
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from app.archive import archive_deleted
+from app.checkout import checkout, InsufficientStock
+from app.export import day_start, export_lines
+from app.ledger import stock_at, take_snapshot
+from app.models import Unit, Category, Product, ProductUnit, ProductBatch, ProductSale, SaleTransaction, \
+    DailySalesRollup, HourlySalesRollup, ReorderSuggestion, StockMovement, StockSnapshot, ArchivedProductBatch, \
+    ArchivedProductSale, ArchivedSaleTransaction
+from app.reorder import compute_reorders
+from app.rollups import rebuild_day, TOTALS
+
+
+def create_product_unit(name="rice"):
+    unit, _ = Unit.objects.get_or_create(name="bag")
+    category, _ = Category.objects.get_or_create(name="grains")
+    product = Product.objects.create(name=name, category=category)
+    return ProductUnit.objects.create(product=product, unit=unit)
+
+
+class CheckoutTests(TestCase):
+    def test_line_is_allocated_across_batches_oldest_first(self):
+        product_unit = create_product_unit()
+        oldest = ProductBatch.objects.create(product_unit=product_unit, quantity=10, cost_price=1, selling_price=2)
+        newest = ProductBatch.objects.create(product_unit=product_unit, quantity=40, cost_price=3, selling_price=4)
+
+        sale = checkout([{"product_unit": product_unit, "quantity": 30}])
+
+        lines = sale.productsale_set.order_by("id")
+        self.assertEqual([(line.batch_id, line.quantity) for line in lines], [(oldest.pk, 10), (newest.pk, 20)])
+        self.assertEqual(sale.total_cost_price(), 70)
+        self.assertEqual(ProductBatch.objects.get(pk=oldest.pk).quantity, 0)
+        self.assertEqual(ProductBatch.objects.get(pk=newest.pk).quantity, 20)
+        product_unit.stock.refresh_from_db()
+        self.assertEqual(product_unit.stock.current_batch_id, newest.pk)
+        self.assertEqual(product_unit.stock.total_quantity, 20)
+
+    def test_insufficient_stock_is_rejected(self):
+        product_unit = create_product_unit()
+        ProductBatch.objects.create(product_unit=product_unit, quantity=5, cost_price=1, selling_price=2)
+
+        with self.assertRaisesMessage(InsufficientStock, "Only 5"):
+            checkout([{"product_unit": product_unit, "quantity": 6}])
+        self.assertFalse(ProductSale.objects.exists())
+
+    def test_single_sale_line_is_allocated_across_batches(self):
+        product_unit = create_product_unit()
+        oldest = ProductBatch.objects.create(product_unit=product_unit, quantity=10, cost_price=1, selling_price=2)
+        newest = ProductBatch.objects.create(product_unit=product_unit, quantity=40, cost_price=3, selling_price=4)
+        sale = SaleTransaction.objects.create()
+
+        ProductSale.objects.create(product_unit=product_unit, sale=sale, quantity=30)
+
+        lines = ProductSale.objects.filter(sale=sale).order_by("id")
+        self.assertEqual([(line.batch_id, line.quantity, line.cost_price) for line in lines],
+                         [(oldest.pk, 10, 1), (newest.pk, 20, 3)])
+        self.assertEqual(ProductBatch.objects.get(pk=oldest.pk).quantity, 0)
+        self.assertEqual(ProductBatch.objects.get(pk=newest.pk).quantity, 20)
+        self.assertEqual(StockMovement.objects.filter(kind=StockMovement.SALE).aggregate(total=Sum("quantity")),
+                         {"total": -30})
+
+    def test_single_sale_line_beyond_stock_is_rejected_before_the_insert(self):
+        product_unit = create_product_unit()
+        ProductBatch.objects.create(product_unit=product_unit, quantity=5, cost_price=1, selling_price=2)
+
+        with self.assertRaisesMessage(InsufficientStock, "Only 5"):
+            ProductSale.objects.create(product_unit=product_unit, quantity=6)
+        self.assertFalse(ProductSale.global_objects.exists())
+        self.assertEqual(ProductBatch.objects.get().quantity, 5)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        product_unit = create_product_unit()
+        self.batches = ProductBatch.objects.bulk_create(
+            ProductBatch(product_unit=product_unit, quantity=i, cost_price=1, selling_price=2) for i in range(1, 6))
+
+    def test_rows_are_read_and_encoded_a_chunk_at_a_time(self):
+        iterator = QuerySet.iterator
+        with mock.patch("app.export.CHUNK_SIZE", 2), \
+                mock.patch.object(QuerySet, "iterator", autospec=True, side_effect=iterator) as read:
+            chunks = list(export_lines("batches", "csv"))
+
+        read.assert_called_once_with(mock.ANY, chunk_size=2)
+        self.assertEqual([len(chunk.splitlines()) for chunk in chunks], [1, 2, 2, 1])
+        self.assertEqual([line.split(",")[2] for line in "".join(chunks).splitlines()[1:]], ["1", "2", "3", "4", "5"])
+
+    def test_rows_are_filtered_by_local_day(self):
+        ProductBatch.objects.filter(pk=self.batches[0].pk).update(created_at=day_start(timezone.localdate()))
+        ProductBatch.objects.filter(pk=self.batches[1].pk).update(
+            created_at=day_start(timezone.localdate()) - timedelta(microseconds=1))
+
+        lines = "".join(export_lines("batches", "ndjson", start=timezone.localdate())).splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertNotIn(f'"id": {self.batches[1].pk},', "".join(lines))
+
+    def test_command_writes_to_stdout_or_a_file(self):
+        out = StringIO()
+        call_command("export_data", "batches", "--format", "csv", stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 6)
+
+        with tempfile.NamedTemporaryFile(mode="r", suffix=".ndjson") as output:
+            call_command("export_data", "batches", "--output", output.name,
+                         "--start", timezone.localdate().isoformat())
+            self.assertEqual(len(output.read().splitlines()), 5)
+
+
+class SalesRollupTests(TestCase):
+    def rollups(self, model):
+        return list(model.objects.order_by("period", "product_unit").values("period", "product_unit", "category",
+                                                                          *TOTALS))
+
+    def test_checkout_rollups_match_sales_and_rebuild(self):
+        rice, beans = create_product_unit("rice"), create_product_unit("beans")
+        ProductBatch.objects.create(product_unit=rice, quantity=10, cost_price="1.10", selling_price="2.35")
+        ProductBatch.objects.create(product_unit=rice, quantity=10, cost_price="1.20", selling_price="2.45")
+        ProductBatch.objects.create(product_unit=beans, quantity=10, cost_price="3.00", selling_price="4.99")
+        checkout([{"product_unit": rice, "quantity": 15}, {"product_unit": beans, "quantity": 3}],
+                 percentage_discount="12.5")
+        checkout([{"product_unit": rice, "quantity": 2}])
+
+        daily = DailySalesRollup.objects.get(product_unit=rice)
+        self.assertEqual((daily.units_sold, daily.revenue, daily.cost), (17, Decimal("40.65"), Decimal("19.40")))
+        total_profit = sum(sale.final_profit() for sale in SaleTransaction.objects.all())
+        self.assertEqual(sum(row.profit for row in DailySalesRollup.objects.all()), total_profit)
+        self.assertEqual(sum(row.profit for row in HourlySalesRollup.objects.all()), total_profit)
+
+        recorded = self.rollups(DailySalesRollup), self.rollups(HourlySalesRollup)
+        rebuild_day(timezone.localdate())
+        self.assertEqual((self.rollups(DailySalesRollup), self.rollups(HourlySalesRollup)), recorded)
+
+    def test_soft_deleted_and_restored_sales_leave_the_rollups(self):
+        rice, beans = create_product_unit("rice"), create_product_unit("beans")
+        ProductBatch.objects.create(product_unit=rice, quantity=10, cost_price="1.10", selling_price="2.35")
+        ProductBatch.objects.create(product_unit=beans, quantity=10, cost_price="3.00", selling_price="4.99")
+        sale = checkout([{"product_unit": rice, "quantity": 4}, {"product_unit": beans, "quantity": 3}],
+                        percentage_discount="12.5")
+        checkout([{"product_unit": rice, "quantity": 2}])
+        recorded = self.rollups(DailySalesRollup), self.rollups(HourlySalesRollup)
+
+        for delete in (sale.delete, ProductSale.objects.get(product_unit=rice, sale__percentage_discount=0).delete):
+            delete()
+            current = self.rollups(DailySalesRollup), self.rollups(HourlySalesRollup)
+            rebuild_day(timezone.localdate())
+            self.assertEqual((self.rollups(DailySalesRollup), self.rollups(HourlySalesRollup)), current)
+        self.assertFalse(DailySalesRollup.objects.exists())
+
+        SaleTransaction.deleted_objects.get(pk=sale.pk).restore()
+        ProductSale.deleted_objects.get(product_unit=rice, sale__percentage_discount=0).restore()
+        self.assertEqual((self.rollups(DailySalesRollup), self.rollups(HourlySalesRollup)), recorded)
+
+
+class ReorderTests(TestCase):
+    def test_units_running_out_within_lead_time_are_suggested(self):
+        fast, slow, idle, sold_out, empty = (create_product_unit(name)
+                                             for name in ("rice", "beans", "salt", "sugar", "flour"))
+        for product_unit in (fast, slow, idle):
+            ProductBatch.objects.create(product_unit=product_unit, quantity=50, cost_price=1, selling_price=2)
+        yesterday = timezone.localdate() - timedelta(days=1)
+        # 280, 28 and 56 units over the 28 day window: 10, 1 and 2 a day
+        for product_unit, units_sold in ((fast, 280), (slow, 28), (sold_out, 56)):
+            DailySalesRollup.objects.create(period=yesterday, product_unit=product_unit, units_sold=units_sold)
+
+        compute_reorders(window_days=28, lead_time_days=7, target_cover_days=21)
+
+        # the never stocked and never sold product unit has nothing to reorder
+        suggestions = ReorderSuggestion.objects.order_by("days_of_cover")
+        self.assertEqual([(row.product_unit_id, row.status, row.days_of_cover, row.reorder_quantity)
+                          for row in suggestions],
+                         [(sold_out.pk, ReorderSuggestion.OUT_OF_STOCK, 0, 42),
+                          (fast.pk, ReorderSuggestion.LOW, 5, 160)])
+        self.assertNotIn(empty.pk, [row.product_unit_id for row in suggestions])
+
+    def test_command_can_rebuild_the_rollups_of_the_window(self):
+        product_unit = create_product_unit()
+        ProductBatch.objects.create(product_unit=product_unit, quantity=30, cost_price=1, selling_price=2)
+        checkout([{"product_unit": product_unit, "quantity": 28}])
+        ProductSale.objects.update(created_at=timezone.now() - timedelta(days=1))
+        DailySalesRollup.objects.all().delete()
+
+        call_command("compute_reorders", stdout=StringIO())
+        self.assertFalse(ReorderSuggestion.objects.exists())
+        call_command("compute_reorders", "--rebuild-rollups", stdout=StringIO())
+        self.assertEqual(ReorderSuggestion.objects.get().reorder_quantity, 19)
+
+
+class StockLedgerTests(TestCase):
+    def test_every_stock_change_is_recorded(self):
+        product_unit = create_product_unit()
+        oldest = ProductBatch.objects.create(product_unit=product_unit, quantity=10, cost_price=1, selling_price=2)
+        newest = ProductBatch.objects.create(product_unit=product_unit, quantity=40, cost_price=3, selling_price=4)
+        sale = checkout([{"product_unit": product_unit, "quantity": 30}])
+        newest.refresh_from_db()
+        newest.quantity = 25
+        newest.save()
+        oldest.delete()
+        newest.delete()
+        newest.restore()
+
+        movements = StockMovement.objects.order_by("id")
+        self.assertEqual([(m.kind, m.batch_id, m.quantity) for m in movements], [
+            ("receipt", oldest.pk, 10), ("receipt", newest.pk, 40), ("sale", oldest.pk, -10),
+            ("sale", newest.pk, -20), ("adjustment", newest.pk, 5), ("adjustment", newest.pk, -25),
+            ("adjustment", newest.pk, 25),
+        ])
+        self.assertEqual({m.sale_id for m in movements if m.kind == "sale"}, {sale.pk})
+        self.assertEqual(stock_at(timezone.now()), {product_unit.pk: 25})
+
+    def test_stock_at_adds_movements_to_the_last_snapshot(self):
+        product_unit = create_product_unit()
+        now = timezone.now()
+        for days_ago, kind, quantity in ((3, "receipt", 10), (2, "sale", -4), (1, "adjustment", 1)):
+            StockMovement.objects.create(product_unit=product_unit, kind=kind, quantity=quantity,
+                                         created_at=now - timedelta(days=days_ago))
+        self.assertEqual(take_snapshot(now - timedelta(days=3, hours=-1)), 1)
+        self.assertEqual(take_snapshot(now - timedelta(days=1, hours=12)), 1)
+        with self.assertRaises(ValueError):
+            take_snapshot(now - timedelta(days=2))
+
+        self.assertEqual(stock_at(now - timedelta(days=4)), {})
+        self.assertEqual(stock_at(now - timedelta(days=2, hours=12)), {product_unit.pk: 10})
+        self.assertEqual(stock_at(now - timedelta(days=1, hours=6)), {product_unit.pk: 6})
+        with self.assertNumQueries(3):
+            self.assertEqual(stock_at(now, [product_unit.pk]), {product_unit.pk: 7})
+
+    def test_snapshot_command_covers_the_days_that_are_over(self):
+        product_unit = create_product_unit()
+        ProductBatch.objects.create(product_unit=product_unit, quantity=10, cost_price=1, selling_price=2)
+        StockMovement.objects.update(created_at=day_start(timezone.localdate() - timedelta(days=3)))
+        checkout([{"product_unit": product_unit, "quantity": 4}])
+
+        call_command("snapshot_stock", stdout=StringIO())
+        self.assertEqual(list(StockSnapshot.objects.values_list("taken_at", "quantity")),
+                         [(day_start(timezone.localdate() - timedelta(days=2)), 10)])
+        self.assertEqual(stock_at(timezone.now()), {product_unit.pk: 6})
+
+
+class IndexUsageTests(TestCase):
+    """The hot batch lookups must be answered from their indexes, not by scanning the table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product_unit = create_product_unit()
+        # sold out batches pile up over time, which is what the FIFO index leaves out
+        ProductBatch.objects.bulk_create(ProductBatch(product_unit=cls.product_unit, quantity=0, cost_price=1,
+                                                      selling_price=2) for _ in range(50))
+        ProductBatch.objects.create(product_unit=cls.product_unit, quantity=10, cost_price=1, selling_price=2)
+
+    def assertUsesIndex(self, queryset, index):
+        with connection.cursor() as cursor:
+            # give the planner table statistics to choose between the indexes with
+            cursor.execute("ANALYZE")
+            if connection.vendor == "postgresql":
+                # the test tables are too small for the planner to prefer an index on its own
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            self.assertIn(index, queryset.explain())
+
+    def test_fifo_batch_lookups_use_partial_index(self):
+        pks = [self.product_unit.pk]
+        self.assertUsesIndex(ProductBatch.objects.filter(product_unit_id__in=pks, quantity__gt=0)
+                             .order_by("product_unit_id", "created_at", "id"), "productbatch_fifo_idx")
+        self.assertUsesIndex(self.product_unit.productbatch_set.filter(quantity__gt=0).order_by("created_at"),
+                             "productbatch_fifo_idx")
+
+    def test_deleted_rows_use_partial_index(self):
+        for model, index in ((ProductBatch, "productbatch_deleted_idx"), (ProductSale, "productsale_deleted_idx"),
+                             (SaleTransaction, "saletransaction_deleted_idx")):
+            with self.subTest(model=model.__name__):
+                self.assertUsesIndex(model.global_objects.filter(deleted_at__isnull=False), index)
+
+    def test_live_rows_by_date_use_partial_index(self):
+        since = timezone.now() - timedelta(days=1)
+        for model, index in ((ProductBatch, "productbatch_created_idx"), (ProductSale, "productsale_created_idx"),
+                             (SaleTransaction, "saletransaction_created_idx")):
+            with self.subTest(model=model.__name__):
+                self.assertUsesIndex(model.objects.filter(created_at__gte=since).values("created_at"), index)
+
+
+class ArchiveTests(TestCase):
+    def test_old_soft_deleted_rows_are_moved_in_chunks(self):
+        product_unit = create_product_unit()
+        sold_out = ProductBatch.objects.create(product_unit=product_unit, quantity=5, cost_price=1, selling_price=2)
+        ProductBatch.objects.create(product_unit=product_unit, quantity=5, cost_price=1, selling_price=2)
+        old_sale = checkout([{"product_unit": product_unit, "quantity": 5}])
+        recent_sale = checkout([{"product_unit": product_unit, "quantity": 1}])
+        old_sale.delete()
+        recent_sale.delete()
+        ProductBatch.objects.get(pk=sold_out.pk).delete()
+        long_ago = timezone.now() - timedelta(days=100)
+        SaleTransaction.global_objects.filter(pk=old_sale.pk).update(deleted_at=long_ago)
+        ProductSale.global_objects.filter(sale=old_sale).update(deleted_at=long_ago)
+        ProductBatch.global_objects.filter(pk=sold_out.pk).update(deleted_at=long_ago)
+
+        self.assertEqual(archive_deleted(days=90, batch_size=1),
+                         {"ProductSale": 1, "SaleTransaction": 1, "ProductBatch": 1})
+        self.assertEqual(list(ArchivedSaleTransaction.objects.values_list("id", flat=True)), [old_sale.pk])
+        self.assertEqual(list(ArchivedProductSale.objects.values_list("sale_id", "batch_id", "quantity")),
+                         [(old_sale.pk, sold_out.pk, 5)])
+        self.assertEqual(list(ArchivedProductBatch.objects.values_list("id", flat=True)), [sold_out.pk])
+        self.assertEqual(list(SaleTransaction.global_objects.values_list("id", flat=True)), [recent_sale.pk])
+        self.assertEqual(ProductSale.global_objects.count(), 1)
+        self.assertEqual(ProductBatch.objects.count(), 1)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    threads = 8
+    checkouts_per_thread = 5
+
+    def test_concurrent_checkouts_never_oversell(self):
+        product_unit = create_product_unit()
+        for _ in range(3):
+            ProductBatch.objects.create(product_unit=product_unit, quantity=10, cost_price=1, selling_price=2)
+        barrier = threading.Barrier(self.threads)
+        sold, rejected, errors = [], [], []
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(self.checkouts_per_thread):
+                    try:
+                        checkout([{"product_unit": product_unit, "quantity": 1}])
+                        sold.append(1)
+                    except InsufficientStock:
+                        rejected.append(1)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(sold), 30)
+        self.assertEqual(len(rejected), self.threads * self.checkouts_per_thread - 30)
+        self.assertEqual(ProductSale.objects.aggregate(total=Sum("quantity"))["total"], 30)
+        self.assertFalse(ProductBatch.objects.filter(quantity__gt=0).exists())
+        product_unit.stock.refresh_from_db()
+        self.assertTrue(product_unit.stock.out_of_stock)
@@ -0,0 +1,49 @@
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import F, Sum
+
+from app.models import ProductBatch
+
+VALUES = ("on_hand", "cost_value", "retail_value", "potential_profit")
+
+# lookups of the id and name of each grouping, relative to ProductBatch
+VALUATION_GROUPS = {
+    "product": ("product_unit__product_id", "product_unit__product__name"),
+    "category": ("product_unit__product__category_id", "product_unit__product__category__name"),
+    "unit": ("product_unit__unit_id", "product_unit__unit__name"),
+}
+
+VALUATION_FILTERS = {
+    "product": "product_unit__product_id",
+    "category": "product_unit__product__category_id",
+    "unit": "product_unit__unit_id",
+}
+
+
+def stock_value(price):
+    return Sum(F(price) * F("quantity"), output_field=models.DecimalField(max_digits=14, decimal_places=2))
+
+
+def inventory_valuation(group_by="product", **filters):
+    """
+    Value the stock on hand per product, category or unit with one grouped query.
+
+    Potential profit is summed straight off the `total_profit` generated column of the batches.
+    """
+    group_id, group_name = VALUATION_GROUPS[group_by]
+    batches = ProductBatch.objects.filter(quantity__gt=0, product_unit__deleted_at__isnull=True)
+    for name, value in filters.items():
+        batches = batches.filter(**{VALUATION_FILTERS[name]: value})
+    return (batches.values(group_id=F(group_id), group_name=F(group_name))
+            .annotate(on_hand=Sum("quantity"), cost_value=stock_value("cost_price"),
+                      retail_value=stock_value("selling_price"), potential_profit=Sum("total_profit"))
+            .order_by("group_name", "group_id"))
+
+
+def valuation_totals(rows):
+    totals = dict.fromkeys(VALUES, 0)
+    for row in rows:
+        for name in VALUES:
+            totals[name] += row[name] if name == "on_hand" else Decimal(row[name]).quantize(Decimal("0.01"))
+    return totals
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,12 +83,47 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+DB_ENGINE = config("DB_ENGINE", default="sqlite")
+
+if DB_ENGINE == "postgresql":
+    # needs psycopg, and psycopg[pool] when DB_POOL is on
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config("DB_NAME"),
+            'USER': config("DB_USER", default=""),
+            'PASSWORD': config("DB_PASSWORD", default=""),
+            'HOST': config("DB_HOST", default="localhost"),
+            'PORT': config("DB_PORT", default="5432"),
+            'CONN_MAX_AGE': config("DB_CONN_MAX_AGE", default=60, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if config("DB_POOL", default=False, cast=bool):
+        DATABASES['default']['OPTIONS']['pool'] = {
+            "min_size": config("DB_POOL_MIN_SIZE", default=2, cast=int),
+            "max_size": config("DB_POOL_MAX_SIZE", default=10, cast=int),
+        }
+        # pooled connections go back to the pool after each request instead of persisting
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+else:
+    # also what the benchmark_checkout command compares against the sqlite defaults
+    SQLITE_TUNED_OPTIONS = {
+        # writers queue on the busy timeout at BEGIN instead of failing with "database is locked"
+        # when a read transaction tries to upgrade to a write
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': config("SQLITE_BUSY_TIMEOUT", default=20, cast=int),
+        # readers no longer block the writer, and commits skip the fsync of every transaction
+        'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+    }
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config("DB_NAME", default=str(BASE_DIR / 'db.sqlite3')),
+            'OPTIONS': dict(SQLITE_TUNED_OPTIONS) if config("SQLITE_TUNED", default=True, cast=bool) else {},
+        }
     }
-}
 
 
 # Password validation
@@ -163,6 +199,28 @@ REST_FRAMEWORK = {
     "DATE_FORMAT": "%Y-%m-%d",
     "TIME_FORMAT": "%H:%M:%S"
 }
+RESPONSE_CACHE = {
+    # "locmem", "sqlite" or empty to turn the catalog response cache off
+    "BACKEND": config("RESPONSE_CACHE_BACKEND", default="locmem"),
+    "PATH": config("RESPONSE_CACHE_PATH", default=str(BASE_DIR / "response_cache.sqlite3")),
+    "MAX_ENTRIES": config("RESPONSE_CACHE_MAX_ENTRIES", default=1000, cast=int),
+    "MAX_BYTES": config("RESPONSE_CACHE_MAX_BYTES", default=32 * 1024 * 1024, cast=int),
+}
+
+# how long the outcome of a POST /sales is replayed to retries carrying the same Idempotency-Key
+IDEMPOTENCY_KEY_TTL_HOURS = config("IDEMPOTENCY_KEY_TTL_HOURS", default=24, cast=int)
+# how long a request may hold a key without an outcome before a retry takes the claim over
+IDEMPOTENCY_CLAIM_LEASE_SECONDS = config("IDEMPOTENCY_CLAIM_LEASE_SECONDS", default=300, cast=int)
+
+METRICS = {
+    # per view request histograms, served at /metrics
+    "ENABLED": config("METRICS_ENABLED", default=True, cast=bool),
+    # requests at least this slow are logged with their duplicate queries, 0 turns the log off
+    "SLOW_REQUEST_SECONDS": config("METRICS_SLOW_REQUEST_SECONDS", default=1.0, cast=float),
+    # bearer token /metrics requires; when empty, /metrics is open and must not be reachable publicly
+    "TOKEN": config("METRICS_TOKEN", default=""),
+}
+
 STATIC_URL = '/static/'
 STATIC_ROOT = "static"
 STATIC_DIR = (os.path.join(BASE_DIR.parent, "static"),)
@@ -21,6 +21,7 @@ from django.shortcuts import redirect
 from django.urls import path, include
 
 from config import settings
+from core.views import metrics
 
 
 def swagger(request):
@@ -31,6 +32,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/", include("api.urls")),
     path("accounts/logout/", swagger, name="logout"),
+    path("metrics", metrics, name="metrics"),
 ]
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
@@ -0,0 +1,180 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+
+from core.models import CacheVersion
+
+CachedResponse = namedtuple("CachedResponse", ("content", "content_type"))
+
+
+class LocMemBackend:
+    """In-process LRU store capped by entry count and total body size."""
+
+    def __init__(self, max_entries, max_bytes, **options):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        """Store `entry` and return how many entries were evicted to make room for it."""
+        evicted = 0
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.content)
+            self.entries[key] = entry
+            self.size += len(entry.content)
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                _, oldest = self.entries.popitem(last=False)
+                self.size -= len(oldest.content)
+                evicted += 1
+        return evicted
+
+    def usage(self):
+        with self.lock:
+            return len(self.entries), self.size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class SQLiteBackend:
+    """LRU store in a SQLite file, shared by every worker process of a node."""
+
+    def __init__(self, max_entries, max_bytes, path, **options):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = str(path)
+        self.local = threading.local()
+        self.execute("CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, content BLOB, "
+                     "content_type TEXT, size INTEGER, accessed_at REAL)")
+        self.execute("CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache (accessed_at)")
+
+    @property
+    def connection(self):
+        if not hasattr(self.local, "connection"):
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return self.local.connection
+
+    def execute(self, sql, params=()):
+        return self.connection.execute(sql, params)
+
+    def get(self, key):
+        row = self.execute("SELECT content, content_type FROM response_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return CachedResponse(bytes(row[0]), row[1])
+
+    def set(self, key, entry):
+        self.execute("INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?)",
+                     (key, entry.content, entry.content_type, len(entry.content), time.time()))
+        evicted = 0
+        entries, size = self.usage()
+        while entries > self.max_entries or size > self.max_bytes:
+            # drop the least recently used tenth in one statement
+            batch = max(1, entries // 10)
+            self.execute("DELETE FROM response_cache WHERE key IN "
+                         "(SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?)", (batch,))
+            evicted += batch
+            entries, size = self.usage()
+        return evicted
+
+    def usage(self):
+        entries, size = self.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache").fetchone()
+        return entries, size
+
+    def clear(self):
+        self.execute("DELETE FROM response_cache")
+
+
+BACKENDS = {
+    "locmem": LocMemBackend,
+    "sqlite": SQLiteBackend,
+}
+
+
+def get_versions(names):
+    versions = dict(CacheVersion.objects.filter(name__in=names).values_list("name", "token"))
+    return tuple(versions.get(name, "") for name in names)
+
+
+def bump_version(name):
+    """Invalidate every response cached against `name` once the current transaction commits."""
+
+    def bump():
+        CacheVersion.objects.bulk_create([CacheVersion(name=name, token=uuid.uuid4().hex)], update_conflicts=True,
+                                         unique_fields=["name"], update_fields=["token"])
+
+    # robust: the write has committed by then, a failed bump must not fail the request that made it
+    transaction.on_commit(bump, robust=True)
+
+
+class ResponseCache:
+    """
+    Cache of rendered responses keyed by request and by the version tokens of the models they
+    are built from, so a write to any of those models makes the old entries unreachable.
+    """
+
+    def __init__(self, backend, **options):
+        self.backend = BACKENDS[backend](**options)
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "not_modified": 0, "evictions": 0}
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def key(self, request, media_type, models):
+        """Return the cache key and ETag of `request` rendered as `media_type` from `models`."""
+        versions = get_versions(sorted(models))
+        query = "&".join(sorted(f"{name}={value}" for name, values in request.GET.lists() for value in values))
+        key = "|".join((request.path, query, media_type, *versions))
+        return key, '"%s"' % hashlib.sha1(key.encode()).hexdigest()
+
+    def get(self, key):
+        entry = self.backend.get(key)
+        self.count("hits" if entry is not None else "misses")
+        return entry
+
+    def set(self, key, entry):
+        self.count("evictions", self.backend.set(key, entry))
+
+    def stats(self):
+        entries, size = self.backend.usage()
+        with self.lock:
+            return {**self.counters, "entries": entries, "bytes": size}
+
+    def clear(self):
+        self.backend.clear()
+
+
+_response_cache = None
+
+
+def get_response_cache():
+    """Return the process wide response cache, or None when RESPONSE_CACHE has no backend."""
+    global _response_cache
+    if _response_cache is None and settings.RESPONSE_CACHE["BACKEND"]:
+        _response_cache = ResponseCache(**{key.lower(): value for key, value in settings.RESPONSE_CACHE.items()})
+    return _response_cache
@@ -0,0 +1,164 @@
+import bisect
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# distinct statements a request keeps for the slow request log, later ones are only counted
+SQL_SAMPLE_SIZE = 100
+
+# name: (help, buckets)
+HISTOGRAMS = {
+    "http_request_duration_seconds": ("Time to serve the request", LATENCY_BUCKETS),
+    "http_request_sql_queries": ("SQL queries run by the request", QUERY_BUCKETS),
+    "http_request_sql_duration_seconds": ("Time spent in SQL queries", LATENCY_BUCKETS),
+    "http_request_serialize_duration_seconds": ("Time spent in the view outside SQL and rendering, "
+                                                "mostly serialization", LATENCY_BUCKETS),
+    "http_request_render_duration_seconds": ("Time spent rendering the response body", LATENCY_BUCKETS),
+    "http_response_size_bytes": ("Size of the response body", SIZE_BUCKETS),
+}
+
+FINGERPRINT_PATTERNS = (
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\((?:\s*\?\s*,)*\s*\?\s*\)"), "(...)"),
+    (re.compile(r"\s+"), " "),
+)
+
+
+def fingerprint(sql):
+    """Reduce `sql` to its shape, with literals, placeholders and IN lists collapsed."""
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        """Yield (le, cumulative count) per bucket, ending with +Inf."""
+        total = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry:
+    """Per view and method histograms of the requests served by this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, labels, **values):
+        with self.lock:
+            for name, value in values.items():
+                histogram = self.histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self.histograms[(name, labels)] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def render(self):
+        """Return the histograms in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name, (description, _) in HISTOGRAMS.items():
+                series = sorted((labels, histogram) for (metric, labels), histogram in self.histograms.items()
+                                if metric == name)
+                if not series:
+                    continue
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+                for labels, histogram in series:
+                    label = ",".join(f'{key}="{escape(value)}"' for key, value in labels)
+                    for bound, count in histogram.samples():
+                        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+                    lines.append(f"{name}_sum{{{label}}} {histogram.sum:g}")
+                    lines.append(f"{name}_count{{{label}}} {sum(histogram.counts)}")
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    """What one request spent its time on, filled in while it is served."""
+
+    def __init__(self, keep_sql, sample_size=SQL_SAMPLE_SIZE):
+        self.keep_sql = keep_sql
+        self.sample_size = sample_size
+        self.queries = 0
+        self.sql_time = 0
+        self.render_time = 0
+        # {statement: times run}; the same query shape is usually the same string, so an N+1 is
+        # one entry however many times it runs, and fingerprinting waits until a request is slow
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # installed as a database execute wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+            if self.keep_sql and (sql in self.statements or len(self.statements) < self.sample_size):
+                self.statements[sql] += 1
+
+    def duplicates(self):
+        """Return {fingerprint: count} of the sampled query shapes that ran more than once."""
+        shapes = Counter()
+        for sql, count in self.statements.items():
+            shapes[fingerprint(sql)] += count
+        return {shape: count for shape, count in shapes.most_common() if count > 1}
+
+
+current_request = ContextVar("current_request", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper of every connection, counting queries against the request being served."""
+    metrics = current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    # the context variable follows async views into the threads their queries run in, which a
+    # wrapper installed per request on the connection of the event loop's context would not
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def timing_render():
+    """Add the time spent in the block to the render time of the request being served."""
+    metrics = current_request.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.render_time += time.perf_counter() - started
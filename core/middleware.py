@@ -0,0 +1,77 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from core.metrics import RequestMetrics, current_request, registry
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMiddleware:
+    """
+    Record per view and method how long each request took, how much of that went to SQL,
+    serialization and rendering, how many queries it ran and how large its response was.
+
+    Requests slower than METRICS["SLOW_REQUEST_SECONDS"] are logged with the query shapes they
+    ran more than once, which is how an N+1 shows up.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.METRICS["ENABLED"]:
+            return self.get_response(request)
+        with self.recording() as metrics:
+            started = time.perf_counter()
+            response = self.get_response(request)
+            self.observe(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS["ENABLED"]:
+            return await self.get_response(request)
+        with self.recording() as metrics:
+            started = time.perf_counter()
+            response = await self.get_response(request)
+            self.observe(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    @contextmanager
+    def recording(self):
+        metrics = RequestMetrics(keep_sql=bool(settings.METRICS["SLOW_REQUEST_SECONDS"]))
+        # queries are counted by core.metrics.record_query, installed on every connection
+        token = current_request.set(metrics)
+        try:
+            yield metrics
+        finally:
+            current_request.reset(token)
+
+    def observe(self, request, response, metrics, elapsed):
+        match = request.resolver_match
+        view = match.route if match else "unmatched"
+        size = len(response.content) if not response.streaming else 0
+        registry.observe(
+            (("method", request.method), ("view", view)),
+            http_request_duration_seconds=elapsed,
+            http_request_sql_queries=metrics.queries,
+            http_request_sql_duration_seconds=metrics.sql_time,
+            http_request_serialize_duration_seconds=max(elapsed - metrics.sql_time - metrics.render_time, 0),
+            http_request_render_duration_seconds=metrics.render_time,
+            http_response_size_bytes=size,
+        )
+        slow = settings.METRICS["SLOW_REQUEST_SECONDS"]
+        if slow and elapsed >= slow:
+            logger.warning("Slow request %s %s (%s): %.3fs, %d queries in %.3fs, duplicate queries: %s",
+                           request.method, request.path, view, elapsed, metrics.queries, metrics.sql_time,
+                           metrics.duplicates() or "none")
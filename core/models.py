@@ -19,3 +19,8 @@ class BaseModel(SoftDeleteModel):
         self.refresh_from_db()
         return self
 
+
+class CacheVersion(models.Model):
+    """Version token of a model, replaced on every write to invalidate the responses built from it"""
+    name = models.CharField(max_length=100, primary_key=True)
+    token = models.CharField(max_length=32)
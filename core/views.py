@@ -0,0 +1,21 @@
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from core.metrics import registry
+
+
+def metrics(request):
+    """
+    Expose the request metrics of this process for Prometheus to scrape.
+
+    With METRICS["TOKEN"] set, scrapers must send it as a bearer token. Without it the endpoint
+    is open and has to be kept off the public network.
+    """
+    if not settings.METRICS["ENABLED"]:
+        raise Http404
+    token = settings.METRICS["TOKEN"]
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return HttpResponse(status=401, headers={"WWW-Authenticate": "Bearer"})
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")